@@ -1,7 +1,11 @@
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import json
 import sys
 import random
+import re
+import os
+import profiling
 
 FUNCTIONS_PATH = Path('BP/functions')
 
@@ -16,8 +20,9 @@ def generate_tellraw_command(
     Generates the tellraw command with the function name.
     '''
     if random_colors:
-        random.seed(func_name)
-        func_name = f"§{random.sample(COLOR_CODES, 1)[0]}{func_name}"
+        # The same function always gets the same color
+        rng = random.Random(func_name)
+        func_name = f"§{rng.sample(COLOR_CODES, 1)[0]}{func_name}"
     tellraw_data = {
         "rawtext": [
             {"text": prefix},
@@ -30,8 +35,174 @@ def generate_tellraw_command(
         tellraw_data, separators=(',', ':'), ensure_ascii=False)
     return f"tellraw @a {tellraw_text_data}"
 
+def glob_to_regex(pattern: str) -> str:
+    '''
+    Converts a glob pattern to a regular expression that matches the same
+    relative paths of the files as Path.glob. The "**" matches any number of
+    directories, the "*" and "?" don't match the "/" character. Path.glob
+    yields only directories for the patterns that end with "**", so they
+    don't match any files.
+    '''
+    result = []
+    segments = pattern.split('/')
+    if segments[-1] == '**':
+        return '(?!)'  # Matches nothing
+    for i, segment in enumerate(segments):
+        is_last = i == len(segments) - 1
+        if segment == '**':
+            # Any number of directories (including none)
+            result.append('(?:[^/]+/)*')
+            continue
+        j = 0
+        while j < len(segment):
+            c = segment[j]
+            j += 1
+            end = segment.find(']', j + 1) if c == '[' else -1
+            if c == '*':
+                result.append('[^/]*')
+            elif c == '?':
+                result.append('[^/]')
+            elif end != -1:
+                chars = segment[j:end]
+                negate = chars.startswith('!')
+                if negate:
+                    chars = chars[1:]
+                # Escape everything except the ranges. The "[" and the
+                # doubled "&&", "~~" and "||" would be read as nested sets
+                # and set operations by the future versions of re.
+                chars = ''.join(
+                    ch if ch == '-' else re.escape(ch) for ch in chars)
+                result.append(f'[^{chars}]' if negate else f'[{chars}]')
+                j = end + 1
+            else:
+                result.append(re.escape(c))
+        if not is_last:
+            result.append('/')
+    return ''.join(result)
 
-if __name__ == '__main__':
+def compile_globs(patterns: list[str]) -> re.Pattern[str]:
+    '''
+    Compiles a list of glob patterns into a single regular expression. The
+    paths are case-insensitive on Windows (like in Path.glob).
+    '''
+    flags = re.IGNORECASE if os.name == 'nt' else 0
+    if len(patterns) == 0:
+        return re.compile('(?!)')  # Matches nothing
+    return re.compile(
+        '|'.join(f'(?:{glob_to_regex(p)})' for p in patterns), flags)
+
+def find_functions(include: list[str], exclude: list[str]) -> list[Path]:
+    '''
+    Finds the files in the functions folder that match any of the include
+    patterns and none of the exclude patterns. The folder is walked only
+    once. The result is sorted.
+    '''
+    include_regex = compile_globs(include)
+    exclude_regex = compile_globs(exclude)
+    paths: list[Path] = []
+    for root, _, files in os.walk(FUNCTIONS_PATH):
+        root_path = Path(root)
+        rel_root = root_path.relative_to(FUNCTIONS_PATH).as_posix()
+        for name in files:
+            rel_path = name if rel_root == '.' else f'{rel_root}/{name}'
+            if (
+                    include_regex.fullmatch(rel_path) is not None and
+                    exclude_regex.fullmatch(rel_path) is None):
+                paths.append(root_path / name)
+    paths.sort()
+    return paths
+
+def instrument_function(path: Path, command: str) -> bool:
+    '''
+    Adds the command at the beginning of the function. Returns False if the
+    function already starts with the command (the file is not modified).
+    '''
+    with path.open('r', encoding="utf8") as f:
+        data = f.read()
+    if data.split('\n', 1)[0] == command:
+        return False
+    data = f"{command}\n" + data
+    with path.open('w', encoding="utf8") as f:
+        f.write(data)
+    return True
+
+def generate_profile_command(func_name: str, objective: str) -> str:
+    '''
+    Generates the command that counts the calls of the function. Every
+    function has its own fake player on the objective.
+    '''
+    return f'scoreboard players add "{func_name}" {objective} 1'
+
+def generate_profile_functions(
+        func_names: list[str], objective: str, top: int,
+        profile_path: str) -> dict[str, str]:
+    '''
+    Generates the functions used for managing the profiling data. Returns a
+    dictionary that maps the names of the functions to their content:
+    - reset - clears the scores (must be run before profiling)
+    - report - displays the objective on the sidebar and prints the top N
+      most called functions
+    - report_round - prints the most called function that wasn't printed
+      yet (used by the report function)
+    '''
+    tmp_objective = f"{objective}_tmp"
+    reset = [
+        f"scoreboard objectives remove {objective}",
+        f'scoreboard objectives add {objective} dummy "Function calls"',
+    ]
+    report = [
+        f"scoreboard objectives setdisplay sidebar {objective} descending",
+    ]
+    report_round: list[str] = []
+    if top > 0:
+        # The report works on a copy of the scores. In every round, the
+        # functions with the highest score are printed and their copied
+        # scores are set to -1.
+        report.extend([
+            f"scoreboard objectives remove {tmp_objective}",
+            f"scoreboard objectives add {tmp_objective} dummy",
+        ])
+        report.extend(
+            f'scoreboard players operation "{func_name}" {tmp_objective} '
+            f'= "{func_name}" {objective}'
+            for func_name in func_names)
+        header = json.dumps(
+            {"rawtext": [{"text": f"Top {top} most called functions:"}]},
+            separators=(',', ':'), ensure_ascii=False)
+        report.append(f"tellraw @a {header}")
+        report.extend(
+            f"function {profile_path}/report_round" for _ in range(top))
+        report_round = [
+            f"scoreboard players set #max {tmp_objective} 0",
+            f"scoreboard players operation #max {tmp_objective} > "
+            f"* {tmp_objective}",
+        ]
+        for func_name in func_names:
+            condition = (
+                f'execute if score "{func_name}" {tmp_objective} = '
+                f'#max {tmp_objective} if score #max {tmp_objective} '
+                f'matches 1.. run')
+            tellraw_data = json.dumps(
+                {"rawtext": [
+                    {"text": f"{func_name}: "},
+                    {"score": {"name": func_name, "objective": objective}},
+                ]},
+                separators=(',', ':'), ensure_ascii=False)
+            report_round.extend([
+                f"{condition} tellraw @a {tellraw_data}",
+                f'{condition} scoreboard players set "{func_name}" '
+                f'{tmp_objective} -1',
+            ])
+    result = {
+        f"{profile_path}/reset": "\n".join(reset),
+        f"{profile_path}/report": "\n".join(report),
+    }
+    if top > 0:
+        result[f"{profile_path}/report_round"] = "\n".join(report_round)
+    return result
+
+
+def main():
     config = json.loads(sys.argv[1])
     if 'include' in config:
         include = config['include']
@@ -49,23 +220,58 @@ if __name__ == '__main__':
         prefix = config['prefix']
     else:
         prefix = ""
+    # "tellraw" - print the names of the functions
+    # "profile" - count the calls of the functions
+    if 'mode' in config:
+        mode = config['mode']
+    else:
+        mode = "tellraw"
+    if mode not in ("tellraw", "profile"):
+        print(f"Unknown mode: {mode}. Valid modes are: tellraw, profile")
+        sys.exit(1)
+    if 'objective' in config:
+        objective = config['objective']
+    else:
+        objective = "debug_calls"
+    if 'top' in config:
+        top = config['top']
+    else:
+        top = 10
+    if 'profile_path' in config:
+        profile_path = config['profile_path']
+    else:
+        profile_path = "debug_profile"
 
-    paths_set = set()
-    excluded_paths_list = []
-    for excluded_paths in exclude:
-        for path in FUNCTIONS_PATH.glob(excluded_paths):
-            if path.is_file():
-                excluded_paths_list.append(path)
-    for included_files in include:
-        for path in FUNCTIONS_PATH.glob(included_files):
-            if path.is_file() and path not in excluded_paths_list:
-                paths_set.add(path)
-    for path in paths_set:
-        with path.open('r', encoding="utf8") as f:
-            data = f.read()
+    with profiling.phase('scan'):
+        paths = find_functions(include, exclude)
+    func_names: list[str] = []
+    commands: list[str] = []
+    for path in paths:
         func_name = path.as_posix()[len('BP/functions/'):-len(".mcfunction")]
-        tellraw_command = generate_tellraw_command(
-            func_name, prefix, random_colors)
-        data = f"{tellraw_command}\n" + data
-        with path.open('w', encoding="utf8") as f:
-            f.write(data)
+        func_names.append(func_name)
+        if mode == "profile":
+            commands.append(generate_profile_command(func_name, objective))
+        else:
+            commands.append(generate_tellraw_command(
+                func_name, prefix, random_colors))
+    # Reading and writing the files is I/O bound, so threads are enough
+    with profiling.phase('write'), ThreadPoolExecutor() as pool:
+        modified = sum(pool.map(instrument_function, paths, commands))
+    profiling.count('functions', len(paths))
+    profiling.count('instrumented', modified)
+    if modified < len(paths):
+        print(
+            f"Skipped {len(paths) - modified} function(s) that already "
+            "start with the added command")
+    if mode == "profile":
+        # The profiling functions are added after the other functions, so
+        # they don't count their own calls
+        for func_name, data in generate_profile_functions(
+                sorted(func_names), objective, top, profile_path).items():
+            path = FUNCTIONS_PATH / f"{func_name}.mcfunction"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with path.open('w', encoding="utf8") as f:
+                f.write(data)
+
+if __name__ == '__main__':
+    profiling.run('debug_say_function_name', main)
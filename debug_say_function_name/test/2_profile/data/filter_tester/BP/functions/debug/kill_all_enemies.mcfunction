@@ -0,0 +1,3 @@
+scoreboard players add "debug/kill_all_enemies" calls 1
+kill @e[family=land_enemy]
+kill @e[family=air_enemy]
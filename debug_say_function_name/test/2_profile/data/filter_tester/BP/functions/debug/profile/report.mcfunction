@@ -0,0 +1,9 @@
+scoreboard objectives setdisplay sidebar calls descending
+scoreboard objectives remove calls_tmp
+scoreboard objectives add calls_tmp dummy
+scoreboard players operation "debug/kill_all_enemies" calls_tmp = "debug/kill_all_enemies" calls
+scoreboard players operation "init" calls_tmp = "init" calls
+scoreboard players operation "tick" calls_tmp = "tick" calls
+tellraw @a {"rawtext":[{"text":"Top 2 most called functions:"}]}
+function debug/profile/report_round
+function debug/profile/report_round
\ No newline at end of file
@@ -0,0 +1,8 @@
+scoreboard players set #max calls_tmp 0
+scoreboard players operation #max calls_tmp > * calls_tmp
+execute if score "debug/kill_all_enemies" calls_tmp = #max calls_tmp if score #max calls_tmp matches 1.. run tellraw @a {"rawtext":[{"text":"debug/kill_all_enemies: "},{"score":{"name":"debug/kill_all_enemies","objective":"calls"}}]}
+execute if score "debug/kill_all_enemies" calls_tmp = #max calls_tmp if score #max calls_tmp matches 1.. run scoreboard players set "debug/kill_all_enemies" calls_tmp -1
+execute if score "init" calls_tmp = #max calls_tmp if score #max calls_tmp matches 1.. run tellraw @a {"rawtext":[{"text":"init: "},{"score":{"name":"init","objective":"calls"}}]}
+execute if score "init" calls_tmp = #max calls_tmp if score #max calls_tmp matches 1.. run scoreboard players set "init" calls_tmp -1
+execute if score "tick" calls_tmp = #max calls_tmp if score #max calls_tmp matches 1.. run tellraw @a {"rawtext":[{"text":"tick: "},{"score":{"name":"tick","objective":"calls"}}]}
+execute if score "tick" calls_tmp = #max calls_tmp if score #max calls_tmp matches 1.. run scoreboard players set "tick" calls_tmp -1
\ No newline at end of file
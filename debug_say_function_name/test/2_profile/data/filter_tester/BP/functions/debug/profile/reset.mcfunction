@@ -0,0 +1,2 @@
+scoreboard objectives remove calls
+scoreboard objectives add calls dummy "Function calls"
\ No newline at end of file
@@ -0,0 +1,2 @@
+scoreboard players add "init" calls 1
+scoreboard objectives add test dummy
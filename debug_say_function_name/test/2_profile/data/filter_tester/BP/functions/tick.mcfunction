@@ -0,0 +1,3 @@
+scoreboard players add "tick" calls 1
+function init
+function debug/kill_all_enemies
@@ -0,0 +1,2 @@
+kill @e[family=land_enemy]
+kill @e[family=air_enemy]
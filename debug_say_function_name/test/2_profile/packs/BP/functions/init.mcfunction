@@ -0,0 +1 @@
+scoreboard objectives add test dummy
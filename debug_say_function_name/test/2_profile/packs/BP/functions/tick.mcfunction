@@ -0,0 +1,2 @@
+function init
+function debug/kill_all_enemies
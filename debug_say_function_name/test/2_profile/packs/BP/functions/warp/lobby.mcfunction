@@ -0,0 +1 @@
+tp @s 1 2 3 90 0
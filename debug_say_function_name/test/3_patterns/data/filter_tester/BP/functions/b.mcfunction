@@ -0,0 +1,2 @@
+tellraw @a {"rawtext":[{"text":""},{"selector":"@s"},{"text":": "},{"text":"b"}]}
+say b
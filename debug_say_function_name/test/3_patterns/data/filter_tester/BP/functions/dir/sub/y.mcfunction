@@ -0,0 +1,2 @@
+tellraw @a {"rawtext":[{"text":""},{"selector":"@s"},{"text":": "},{"text":"dir/sub/y"}]}
+say dir/sub/y
@@ -0,0 +1 @@
+say other/note
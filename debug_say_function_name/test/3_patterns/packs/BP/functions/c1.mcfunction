@@ -0,0 +1 @@
+say c1
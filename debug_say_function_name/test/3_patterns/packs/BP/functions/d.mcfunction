@@ -0,0 +1 @@
+say d
@@ -0,0 +1 @@
+say dir/sub/deeper/z
@@ -0,0 +1,94 @@
+from pathlib import Path
+import hashlib
+import os
+import shutil
+import time
+import regolith_json_template
+
+# The outputs that weren't used for this number of seconds are removed
+MAX_ENTRY_AGE = 30 * 24 * 60 * 60
+# The maximal total size of the outputs in bytes. The least recently used
+# outputs are removed first.
+MAX_CACHE_SIZE = 256 * 2**20
+
+def filter_version() -> str:
+    '''
+    Returns the hash of the source code of the filter and the version of the
+    regolith_json_template library. The outputs cached by other versions of
+    the filter are never reused.
+    '''
+    version = hashlib.sha256(
+        regolith_json_template.__version__.encode('utf8'))
+    for source in sorted(Path(__file__).parent.glob('*.py')):
+        version.update(source.read_bytes())
+    return version.hexdigest()
+
+class BuildCache:
+    '''
+    The cache of the incremental builds. It maps the hash of the input file,
+    the hash of the scope and the version of the filter to the bytes of the
+    output file. The outputs are stored in the cache_path folder, in files
+    named after their keys, so changing the scope or the filter invalidates
+    all of the entries. The modification time of an output is the time of its
+    last use. The outputs are kept when they aren't used in a run (e.g. when
+    the profiles of the project use different files), they're removed when
+    they get old or when the cache grows too big.
+    '''
+    def __init__(self, cache_path: Path, scope_hash: str, version: str):
+        self.cache_path = cache_path
+        self._prefix = f'{version}\0{scope_hash}\0'.encode('utf8')
+
+    def key(self, p: Path) -> str:
+        '''Returns the key of the current content of the file.'''
+        return hashlib.sha256(self._prefix + p.read_bytes()).hexdigest()
+
+    def restore(self, key: str, p: Path) -> bool:
+        '''
+        Replaces the file with the cached output. Returns False if there is
+        no output with given key in the cache.
+        '''
+        cached_output = self.cache_path / f'{key}.json'
+        try:
+            shutil.copyfile(cached_output, p)
+        except FileNotFoundError:
+            return False
+        try:
+            os.utime(cached_output)
+        except OSError:
+            pass  # Removed by another process, the output is already copied
+        return True
+
+    def store(self, key: str, p: Path):
+        '''Stores the output file in the cache.'''
+        self.cache_path.mkdir(parents=True, exist_ok=True)
+        # Copy to a temporary file first, other processes may write the same
+        # output at the same time.
+        tmp_path = self.cache_path / f'{key}.{os.getpid()}.tmp'
+        shutil.copyfile(p, tmp_path)
+        os.replace(tmp_path, self.cache_path / f'{key}.json')
+
+    def prune(
+            self, max_age: float=MAX_ENTRY_AGE, max_size: int=MAX_CACHE_SIZE):
+        '''
+        Removes the outputs that weren't used for more than max_age seconds
+        and the least recently used outputs that exceed max_size bytes in
+        total.
+        '''
+        if not self.cache_path.exists():
+            return
+        now = time.time()
+        entries = []
+        for cached_output in self.cache_path.iterdir():
+            try:
+                entries.append((cached_output.stat(), cached_output))
+            except OSError:
+                continue
+        entries.sort(key=lambda entry: entry[0].st_mtime, reverse=True)
+        total_size = 0
+        for stat, cached_output in entries:
+            total_size += stat.st_size
+            if now - stat.st_mtime > max_age or total_size > max_size:
+                try:
+                    cached_output.unlink()
+                except OSError:
+                    pass
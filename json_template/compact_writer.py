@@ -0,0 +1,59 @@
+from typing import Any, List, TextIO
+import json
+
+# The number of chunks collected before writing them to the file
+FLUSH_CHUNKS = 4096
+
+def _encode_primitive(o: Any) -> str:
+    if isinstance(o, str):
+        return json.dumps(o)
+    return str(o).lower()
+
+def dump_compact(data: Any, fp: TextIO):
+    '''
+    Writes the data to the file in the same format as
+    json.dump(data, fp, cls=CompactEncoder). The CompactEncoder builds the
+    text of the whole document in memory (the text of every object is
+    created by joining the texts of its children). This function writes the
+    text in small chunks as they're produced, so the memory usage doesn't
+    depend on the size of the output.
+    '''
+    chunks: List[str] = []
+
+    def encode(o: Any, ind: str):
+        if isinstance(o, dict):
+            if len(o) == 0:
+                chunks.append('{}')
+                return
+            inner_ind = ind + '\t'
+            separator = '{\n'
+            for k, v in o.items():
+                chunks.append(f'{separator}{inner_ind}{json.dumps(k)}: ')
+                encode(v, inner_ind)
+                separator = ',\n'
+            chunks.append(f'\n{ind}}}')
+        elif isinstance(o, (list, tuple)):
+            if all(isinstance(i, (int, bool, str, float)) for i in o):
+                # Lists of primitives are written in one line
+                chunks.append(f'[{", ".join(map(_encode_primitive, o))}]')
+                return
+            inner_ind = ind + '\t'
+            separator = '[\n'
+            for i in o:
+                chunks.append(f'{separator}{inner_ind}')
+                encode(i, inner_ind)
+                separator = ',\n'
+            chunks.append(f'\n{ind}]')
+        elif isinstance(o, (int, bool, str, float)):
+            chunks.append(_encode_primitive(o))
+        elif o is None:
+            chunks.append('null')
+        else:
+            raise TypeError(
+                f'Object of type {type(o).__name__} is not JSON serializable')
+        if len(chunks) >= FLUSH_CHUNKS:
+            fp.write(''.join(chunks))
+            chunks.clear()
+
+    encode(data, '')
+    fp.write(''.join(chunks))
@@ -0,0 +1,154 @@
+from typing import Any, Dict, Iterable, List, Optional, Set
+from pathlib import Path
+from types import CodeType
+import builtins
+import marshal
+import os
+import sys
+import time
+import regolith_json_template
+
+# The marshal format of the code objects is specific to the interpreter
+# version, so the cache files are tagged with it (e.g. 'cpython-311').
+CACHE_TAG = sys.implementation.cache_tag or 'python'
+CACHE_FILE_NAME = f'expressions.{CACHE_TAG}.marshal'
+
+# The expressions not used for this long (in seconds) are removed from the
+# cache
+MAX_ENTRY_AGE = 30*24*60*60
+# The last use of the entries is updated with this precision (in seconds), so
+# the runs that use the same expressions don't rewrite the cache
+LAST_USE_PRECISION = 24*60*60
+# The maximal number of the entries in the cache (the least recently used
+# entries are removed first)
+MAX_ENTRIES = 50_000
+
+class ExpressionCache:
+    '''
+    Compiles the expressions of the JSON templates into code objects. Every
+    expression is compiled only once per run (per process), no matter how
+    many times it appears in the files. If the cache_path is provided, the
+    code objects are also stored on disk (using the marshal module) and
+    reused in the following runs. The entries are keyed by the text of the
+    expression and the version of the interpreter. The entries that weren't
+    used for MAX_ENTRY_AGE seconds are removed from the cache, and the cache
+    never has more than MAX_ENTRIES entries.
+    '''
+    def __init__(self, cache_path: Optional[Path]=None):
+        self.cache_path = cache_path
+        self.hits = 0
+        self.misses = 0
+        self._code: Dict[str, CodeType] = {}
+        # The expressions used since the last call of take_used
+        self._used: Set[str] = set()
+        # The expressions used in this run that will be stored on disk
+        self._persisted: Set[str] = set()
+        # The time of the last use of the entries loaded from the disk
+        self._last_use: Dict[str, int] = {}
+        if cache_path is not None:
+            self._load()
+
+    def compile(self, source: str) -> CodeType:
+        '''
+        Returns the compiled code of the expression. The result is the same
+        as the one that would be evaluated by eval(source, ...).
+        '''
+        code = self._code.get(source)
+        if code is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            # eval() strips leading spaces and tabs from the source strings
+            # but compile() doesn't.
+            code = compile(source.lstrip(' \t'), '<string>', 'eval')
+            self._code[source] = code
+        self._used.add(source)
+        return code
+
+    def eval(
+            self, source: Any, globals: Optional[Dict[str, Any]]=None,
+            locals: Optional[Dict[str, Any]]=None) -> Any:
+        '''
+        A replacement of the built-in eval function that uses the cache for
+        the expressions passed as strings.
+        '''
+        if isinstance(source, str):
+            source = self.compile(source)
+        return builtins.eval(source, globals, locals)
+
+    def install(self):
+        '''
+        Makes the regolith_json_template module use this cache for evaluating
+        the expressions. The module uses the built-in eval function, which is
+        shadowed by a global variable of the module.
+        '''
+        setattr(regolith_json_template, 'eval', self.eval)
+
+    def take_used(self) -> List[str]:
+        '''
+        Returns the expressions used since the last call of this function.
+        '''
+        used = list(self._used)
+        self._used.clear()
+        return used
+
+    def persist(self, expressions: Iterable[str]):
+        '''
+        Marks the expressions to be stored on disk by the save function. The
+        expressions may come from other processes, so they're compiled if
+        they aren't in the cache yet (without affecting the statistics).
+        '''
+        for source in expressions:
+            if source not in self._code:
+                self._code[source] = compile(
+                    source.lstrip(' \t'), '<string>', 'eval')
+            self._persisted.add(source)
+
+    def _load(self):
+        try:
+            entries = marshal.loads(
+                (self.cache_path / CACHE_FILE_NAME).read_bytes())
+        except (OSError, ValueError, EOFError, TypeError):
+            return  # Missing or stale cache
+        if not isinstance(entries, dict):
+            return
+        for source, entry in entries.items():
+            # Every entry is a tuple (code, last_use)
+            if (
+                    not isinstance(source, str)
+                    or not isinstance(entry, tuple) or len(entry) != 2):
+                continue
+            code, last_use = entry
+            if isinstance(code, CodeType) and isinstance(last_use, int):
+                self._code[source] = code
+                self._last_use[source] = last_use
+
+    def save(self):
+        '''
+        Writes the code objects of the persisted expressions to the cache,
+        together with the entries loaded from the disk that aren't older
+        than MAX_ENTRY_AGE. Does nothing if the cache didn't change.
+        '''
+        if self.cache_path is None:
+            return
+        now = int(time.time())
+        last_use = {
+            source: t for source, t in self._last_use.items()
+            if now - t <= MAX_ENTRY_AGE}
+        for source in self._persisted:
+            if now - last_use.get(source, 0) >= LAST_USE_PRECISION:
+                last_use[source] = now
+        if len(last_use) > MAX_ENTRIES:
+            newest = sorted(last_use, key=last_use.__getitem__, reverse=True)
+            last_use = {
+                source: last_use[source] for source in newest[:MAX_ENTRIES]}
+        if last_use == self._last_use:
+            return
+        self.cache_path.mkdir(parents=True, exist_ok=True)
+        cache_file = self.cache_path / CACHE_FILE_NAME
+        tmp_path = self.cache_path / f'{CACHE_FILE_NAME}.{os.getpid()}.tmp'
+        tmp_path.write_bytes(marshal.dumps({
+            source: (self._code[source], t)
+            for source, t in last_use.items()}))
+        os.replace(tmp_path, cache_file)
+        self._last_use = last_use
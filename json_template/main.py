@@ -1,19 +1,155 @@
 import json
 from pathlib import Path
 import sys
+import os
+import hashlib
+import mmap
+from typing import Any, Dict, List, NamedTuple, Optional
+from concurrent.futures import ProcessPoolExecutor
 from better_json_tools import load_jsonc
-from better_json_tools.compact_encoder import CompactEncoder
 from itertools import chain
 from regolith_json_template import eval_json, DEFAULT_SCOPE, JsonTemplateException
+from expression_cache import ExpressionCache
+from build_cache import BuildCache, filter_version
+from compact_writer import dump_compact
+import profiling
 
 DATA_PATH = Path('data')
 BP_PATH = Path('BP')
 RP_PATH = Path('RP')
 
+# Using the pool for a small number of files is slower than processing them
+# in the main process.
+MIN_PARALLEL_FILES = 32
+
 def print_red(text):
     for t in text.split('\n'):
         print("\033[91m {}\033[00m".format(t))
 
+# The byte sequences that can be a part of the template syntax. The '\u'
+# sequences are included because escaped characters might hide the rest of
+# them.
+TEMPLATE_SYNTAX = (b'`', b'__unpack__', b'\\u')
+
+def may_contain_template(p: Path) -> bool:
+    '''
+    Checks if the raw content of the file contains any of the TEMPLATE_SYNTAX
+    sequences. The file is not parsed, so it's much faster than loading it.
+    If this function returns False, evaluating the file wouldn't change it.
+    '''
+    with p.open('rb') as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                return any(m.find(s) != -1 for s in TEMPLATE_SYNTAX)
+        except ValueError:  # Empty files can't be mapped
+            return False
+
+def process_file(p: Path, scope: Dict[str, Any]):
+    '''
+    Evaluates the JSON template file and saves the result in the same file.
+    '''
+    # LOAD THE FILE
+    try:
+        with profiling.phase('parse'):
+            file_data = load_jsonc(p).data
+    except (OSError, ValueError, TypeError, LookupError) as e:
+        raise JsonTemplateException(
+            f"Failed to load file as JSON:\n"
+            f"  File: {p}\n"
+            f"  Error: {e}")
+    # EVALUATE THE FILE
+    try:
+        with profiling.phase('evaluate'):
+            file_data = eval_json(file_data, scope)
+    except JsonTemplateException as e:
+        raise JsonTemplateException(
+            f"Failed to evaluate JSON template:\n"
+            f"  File: {p}\n"
+            f"  Error: {e}")
+    except Exception as e:
+        # Errors raised by the evaluated expressions
+        raise JsonTemplateException(
+            f"Failed to evaluate JSON template:\n"
+            f"  File: {p}\n"
+            f"  Error: {type(e).__name__}: {e}")
+    # WRITE THE FILE
+    try:
+        with profiling.phase('write'), open(p, 'w') as f:
+            dump_compact(file_data, f)
+    except (OSError, TypeError) as e:
+        # TypeError is raised when data is not JSON serializable
+        raise JsonTemplateException(
+            f"Failed to write file:\n"
+            f"  File: {p}\n"
+            f"  Error: {e}")
+
+class FileResult(NamedTuple):
+    '''The result of processing a file by _process_file_task.'''
+    evaluated: bool  # Evaluated successfully
+    restored: bool  # Restored from the incremental build cache
+    error: str  # An empty string if there was no error
+    cache_hits: int
+    cache_misses: int
+    # The expressions to be stored in the on-disk expression cache
+    expressions: List[str]
+
+# The scope, the expression cache and the build cache of the current process
+# (set by _init_worker)
+_scope: Dict[str, Any] = {}
+_expression_cache = ExpressionCache()
+_build_cache: Optional[BuildCache] = None
+
+def _init_worker(
+        scope_data: Dict[str, Any], compile_cache_path: Optional[Path],
+        build_cache: Optional[BuildCache]):
+    '''
+    Creates the scope and the caches of the current process. The scope is
+    sent to the processes of the pool without the default values (modules
+    can't be pickled).
+    '''
+    global _scope, _expression_cache, _build_cache
+    _scope = DEFAULT_SCOPE | scope_data
+    _expression_cache = ExpressionCache(compile_cache_path)
+    _expression_cache.install()
+    _build_cache = build_cache
+
+def _process_file_task(p: Path) -> FileResult:
+    '''
+    Processes the file using the scope and the caches of the current process.
+    The files without the template syntax are left untouched (they're not
+    hashed nor stored in the build cache). If the build cache has the output
+    of the file, the output is restored instead of evaluating the file.
+    '''
+    cache = _expression_cache
+    hits, misses = cache.hits, cache.misses
+    cache.take_used()
+    evaluated, restored = False, False
+    error = ""
+    try:
+        build_key = ""
+        try:
+            has_template = may_contain_template(p)
+            if has_template and _build_cache is not None:
+                build_key = _build_cache.key(p)
+                restored = _build_cache.restore(build_key, p)
+        except OSError as e:
+            raise JsonTemplateException(
+                f"Failed to read file:\n"
+                f"  File: {p}\n"
+                f"  Error: {e}")
+        if has_template and not restored:
+            process_file(p, _scope)
+            evaluated = True
+            if _build_cache is not None:
+                _build_cache.store(build_key, p)
+    except JsonTemplateException as e:
+        evaluated, error = False, str(e)
+    used = cache.take_used()
+    return FileResult(
+        evaluated, restored, error,
+        cache.hits - hits, cache.misses - misses,
+        used if cache.cache_path is not None else [])
+
 def main():
     '''
     The main function of the Regolith filter.
@@ -25,41 +161,92 @@ def main():
     # Set default config values
     config.setdefault('scope_path', 'json_template/scope.json')
     config.setdefault('patterns', ['BP/**/*.json', 'RP/**/*.json'])
+    # Number of processes used for processing the files (0 - CPU count)
+    config.setdefault('workers', 1)
+    workers = config['workers']
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    # Path to the folder with the persistent caches (relative to the project
+    # folder). The data folder isn't exported, so the caches are kept outside
+    # of it.
+    config.setdefault('cache_path', '.regolith/cache/json_template')
+    config.setdefault('compile_cache', False)
+    config.setdefault('incremental', False)
+    cache_path = Path(config['cache_path'])
+    if not cache_path.is_absolute():
+        cache_path = Path(os.environ.get('ROOT_DIR', '.')) / cache_path
+    compile_cache_path: Optional[Path] = None
+    if config['compile_cache']:
+        compile_cache_path = cache_path
 
-    # Load the combined scope
-    scope = DEFAULT_SCOPE | load_jsonc(DATA_PATH / config['scope_path']).data
+    # Load the scope (the default scope is added by _init_worker)
+    scope_data = load_jsonc(DATA_PATH / config['scope_path']).data
+    build_cache: Optional[BuildCache] = None
+    if config['incremental']:
+        scope_hash = hashlib.sha256(
+            json.dumps(scope_data).encode('utf8')).hexdigest()
+        build_cache = BuildCache(
+            cache_path / 'build', scope_hash, filter_version())
 
-    for p in chain(*[Path(".").glob(p) for p in config['patterns']]):
-        # LOAD THE FILE
-        try:
-            file_data = load_jsonc(p).data
-        except (OSError, ValueError, TypeError, LookupError) as e:
-            raise JsonTemplateException(
-                f"Failed to load file as JSON:\n"
-                f"  File: {p}\n"
-                f"  Error: {e}")
-        # EVALUATE THE FILE
-        try:
-            file_data = eval_json(file_data, scope)
-        except JsonTemplateException as e:
-            raise JsonTemplateException(
-                f"Failed to evaluate JSON template:\n"
-                f"  File: {p}\n"
-                f"  Error: {e}")
-        # WRITE THE FILE
-        try:
-            with open(p, 'w') as f:
-                json.dump(file_data, f, cls=CompactEncoder)
-        except (OSError, TypeError) as e:
-            # TypeError is raised when data is not JSON serializable
-            raise JsonTemplateException(
-                f"Failed to write file:\n"
-                f"  File: {p}\n"
-                f"  Error: {e}")
+    # The files are sorted, so the errors are always reported in the same
+    # order
+    with profiling.phase('scan'):
+        paths = sorted(set(chain(
+            *[Path(".").glob(p) for p in config['patterns']])))
+    results: List[FileResult]
+    if workers > 1 and len(paths) >= MIN_PARALLEL_FILES:
+        # The workers aren't profiled, only the time spent waiting for them
+        # is measured
+        with profiling.phase('process'), ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker,
+                initargs=(scope_data, compile_cache_path, build_cache)
+        ) as pool:
+            results = list(pool.map(
+                _process_file_task, paths,
+                chunksize=max(1, len(paths) // (workers * 4))))
+    else:
+        _init_worker(scope_data, compile_cache_path, build_cache)
+        with profiling.phase('process'):
+            results = list(map(_process_file_task, paths))
+    evaluated = sum(1 for r in results if r.evaluated)
+    restored = sum(1 for r in results if r.restored)
+    failed = sum(1 for r in results if r.error != "")
+    profiling.count('files', len(paths))
+    profiling.count('evaluated', evaluated)
+    profiling.count('restored', restored)
+    profiling.count('failed', failed)
+    if len(paths) > 0:
+        message = (
+            f"Evaluated {evaluated} file(s), skipped "
+            f"{len(paths) - evaluated - restored - failed} file(s) without "
+            "the template syntax")
+        if failed > 0:
+            message += f", failed to evaluate {failed} file(s)"
+        print(message)
+    if build_cache is not None:
+        print(
+            f"Restored {restored} file(s) from the incremental build cache")
+        build_cache.prune()
+    hits = sum(r.cache_hits for r in results)
+    misses = sum(r.cache_misses for r in results)
+    if hits + misses > 0:
+        print(f"Expression cache: {hits} hit(s), {misses} miss(es)")
+    if compile_cache_path is not None:
+        # The expressions could be compiled in other processes, so the cache
+        # of the main process is used to store them.
+        expression_cache = (
+            _expression_cache if _expression_cache.cache_path is not None
+            else ExpressionCache(compile_cache_path))
+        for r in results:
+            expression_cache.persist(r.expressions)
+        expression_cache.save()
+    error_messages: List[str] = [r.error for r in results if r.error != ""]
+    if len(error_messages) > 0:
+        raise JsonTemplateException("\n".join(error_messages))
 
 if __name__ == '__main__':
     try:
-        main()
+        profiling.run('json_template', main)
     except JsonTemplateException as e:
         print_red(f"ERROR: {e}")
         sys.exit(1)
@@ -0,0 +1,33 @@
+'''
+This script is used for testing the parallel evaluation of json_template. It
+checks the files generated by the generate_files.py script and removes them,
+so they don't have to be listed in the expected output of the filter_tester.
+'''
+from pathlib import Path
+import json
+import shutil
+
+GENERATED_PATH = Path("BP/generated")
+GENERATED_FILES = 40
+
+def main():
+    print(f"Checking the evaluated files in: {GENERATED_PATH}")
+    for i in range(GENERATED_FILES):
+        path = GENERATED_PATH / f"file_{i:02}.json"
+        expected = {
+            "id": i,
+            "square": i * i,
+            "item_0": f"{i}_item_0",
+            "item_1": f"{i}_item_1",
+        }
+        with path.open("r") as f:
+            data = json.load(f)
+        if data != expected:
+            raise Exception(
+                f"Unexpected content of {path}:\n"
+                f"Expected: {expected}\n"
+                f"Actual: {data}")
+    shutil.rmtree(GENERATED_PATH)
+
+if __name__ == "__main__":
+    main()
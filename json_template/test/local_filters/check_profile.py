@@ -0,0 +1,36 @@
+'''
+This script is used for testing the profiling of the filters. It checks the
+report written to the profile folder of the project and removes the folder,
+so the next run can't pass the test with an old report.
+
+Settings:
+- filter - the name of the profiled filter.
+- phases - the names of the phases that must be in the report.
+- counts - the expected values of the counters.
+'''
+from pathlib import Path
+import json
+import os
+import shutil
+import sys
+
+def main():
+    config = json.loads(sys.argv[1])
+    profile_path = Path(os.environ['ROOT_DIR']) / 'profile' / config['filter']
+    print(f"Checking the profile in: {profile_path}")
+    with (profile_path / 'profile.json').open('r', encoding='utf8') as f:
+        report = json.load(f)
+    if not (profile_path / 'profile.pstats').exists():
+        raise Exception("The profile doesn't have the cProfile stats")
+    missing_phases = set(config.get('phases', [])) - report['phases'].keys()
+    if len(missing_phases) > 0:
+        raise Exception(f"Missing phases: {sorted(missing_phases)}")
+    for name, value in config.get('counts', {}).items():
+        if report['counts'].get(name) != value:
+            raise Exception(
+                f"Unexpected value of the {name} counter: "
+                f"{report['counts'].get(name)} (expected {value})")
+    shutil.rmtree(profile_path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+'''
+This script is used for testing the parallel evaluation of json_template. It
+generates enough files to make the filter use the pool of processes.
+
+The files are checked and removed by the check_generated_files.py script.
+'''
+from pathlib import Path
+import json
+
+GENERATED_PATH = Path("BP/generated")
+GENERATED_FILES = 40
+
+def main():
+    GENERATED_PATH.mkdir(parents=True, exist_ok=True)
+    for i in range(GENERATED_FILES):
+        data = {
+            "id": i,
+            "square": f"`{i} * {i}`",
+            "`[K(f'item_{j}', j=j) for j in range(2)]`": (
+                f"`'{i}_item_' + str(j)`")
+        }
+        with (GENERATED_PATH / f"file_{i:02}.json").open("w") as f:
+            json.dump(data, f)
+
+if __name__ == "__main__":
+    main()
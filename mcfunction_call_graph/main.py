@@ -0,0 +1,289 @@
+'''
+Builds the call graph of the *.mcfunction files and writes a report about
+it to the data folder. The filter doesn't modify the packs.
+'''
+from pathlib import Path
+from typing import Any, Optional
+import json
+import re
+import sys
+import profiling
+
+FUNCTIONS_PATH = Path('BP/functions')
+TICK_PATH = FUNCTIONS_PATH / 'tick.json'
+DATA_PATH = Path('data')
+
+# "execute ... run <command>" (the command can be another execute)
+EXECUTE_RUN = re.compile(r'^execute\s.*?\srun\s+(.*)$')
+# A coordinate of the legacy execute command ("~", "~-1", "^.5", "10")
+_COORDINATE = r'(?:[~^]-?(?:\d*\.)?\d*|-?(?:\d*\.)?\d+)'
+_POSITION = rf'{_COORDINATE}\s+{_COORDINATE}\s+{_COORDINATE}'
+# The legacy syntax (before Minecraft 1.19.50):
+# "execute <target> <x> <y> <z> [detect <x> <y> <z> <block> <data>] <command>"
+# The target can't be one of the subcommands of the new syntax, so commands
+# like "execute positioned ~ ~ ~ run ..." aren't matched.
+LEGACY_EXECUTE = re.compile(
+    r'^execute\s+'
+    r'(?!(?:align|anchored|as|at|facing|if|in|positioned|rotated|run|unless)'
+    r'\s)'
+    r'(?:@[a-z](?:\[.*?\])?|"[^"]*"|\S+)'
+    rf'\s+{_POSITION}'
+    rf'(?:\s+detect\s+{_POSITION}\s+\S+\s+-?\d+)?'
+    r'\s+(.*)$')
+# "function <name>"
+FUNCTION_COMMAND = re.compile(r'^function\s+(\S+)')
+# "schedule delay add <name> <time> [append|replace]"
+SCHEDULE_DELAY = re.compile(r'^schedule\s+delay\s+add\s+(\S+)')
+# "schedule on_area_loaded add <area> <name>" (the name is the last token)
+SCHEDULE_AREA = re.compile(r'^schedule\s+on_area_loaded\s+add\s.*\s(\S+)$')
+
+class FunctionInfo:
+    '''
+    The information about a function parsed from its file.
+    '''
+    def __init__(self):
+        self.commands = 0
+        # The functions called with the "function" command (in the order of
+        # the calls, with duplicates)
+        self.calls: list[str] = []
+        # The functions scheduled with the "schedule" command
+        self.schedules: list[str] = []
+
+def normalize_name(name: str) -> str:
+    return name.strip('"').strip('/')
+
+def parse_command(command: str, info: FunctionInfo):
+    '''
+    Adds the information about the command to the FunctionInfo.
+    '''
+    info.commands += 1
+    command = command.lstrip('/')
+    while (
+            (match := LEGACY_EXECUTE.match(command)) is not None or
+            (match := EXECUTE_RUN.match(command)) is not None):
+        command = match.group(1).lstrip('/')
+    if (match := FUNCTION_COMMAND.match(command)) is not None:
+        info.calls.append(normalize_name(match.group(1)))
+    elif (match := SCHEDULE_DELAY.match(command)) is not None:
+        info.schedules.append(normalize_name(match.group(1)))
+    elif (match := SCHEDULE_AREA.match(command)) is not None:
+        info.schedules.append(normalize_name(match.group(1)))
+
+def parse_function(path: Path) -> FunctionInfo:
+    info = FunctionInfo()
+    with path.open('r', encoding='utf8') as f:
+        for line in f:
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+            parse_command(line, info)
+    return info
+
+def strongly_connected_components(
+        graph: dict[str, list[str]]) -> list[list[str]]:
+    '''
+    Finds the strongly connected components of the graph using Tarjan's
+    algorithm (iterative, so it works with very long call chains). The
+    components are returned in reverse topological order (every component is
+    listed after the components it calls).
+    '''
+    index: dict[str, int] = {}
+    low_link: dict[str, int] = {}
+    on_stack: set[str] = set()
+    stack: list[str] = []
+    result: list[list[str]] = []
+    for root in graph:
+        if root in index:
+            continue
+        # (node, iterator over the callees)
+        work = [(root, iter(graph[root]))]
+        index[root] = low_link[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        while len(work) > 0:
+            node, callees = work[-1]
+            for callee in callees:
+                if callee not in index:
+                    index[callee] = low_link[callee] = len(index)
+                    stack.append(callee)
+                    on_stack.add(callee)
+                    work.append((callee, iter(graph[callee])))
+                    break
+                if callee in on_stack:
+                    low_link[node] = min(low_link[node], index[callee])
+            else:
+                work.pop()
+                if len(work) > 0:
+                    parent = work[-1][0]
+                    low_link[parent] = min(low_link[parent], low_link[node])
+                if low_link[node] == index[node]:
+                    component: list[str] = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.remove(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    result.append(component)
+    return result
+
+def reachable_from(
+        roots: list[str], graph: dict[str, list[str]]) -> set[str]:
+    reachable = set(roots)
+    stack = list(roots)
+    while len(stack) > 0:
+        for callee in graph[stack.pop()]:
+            if callee not in reachable:
+                reachable.add(callee)
+                stack.append(callee)
+    return reachable
+
+def analyze(
+        functions: dict[str, FunctionInfo], tick_functions: list[str],
+        entry_points: list[str]) -> dict[str, Any]:
+    '''
+    Analyzes the call graph of the functions and returns the report.
+    '''
+    # The references to the functions that don't exist
+    missing: dict[str, list[str]] = {}
+    # The calls that run in the same tick ("function" command)
+    calls: dict[str, list[str]] = {}
+    # All references ("function" and "schedule" commands)
+    references: dict[str, list[str]] = {}
+    for name, info in functions.items():
+        calls[name] = [c for c in info.calls if c in functions]
+        references[name] = sorted(
+            {c for c in info.calls + info.schedules if c in functions})
+        missing_references = sorted(
+            {c for c in info.calls + info.schedules if c not in functions})
+        if len(missing_references) > 0:
+            missing[name] = missing_references
+    for name in tick_functions + entry_points:
+        if name not in functions:
+            missing.setdefault('tick.json/entry_points', []).append(name)
+    tick_functions = [name for name in tick_functions if name in functions]
+    entry_points = [name for name in entry_points if name in functions]
+
+    fan_in: dict[str, int] = {name: 0 for name in functions}
+    for name in functions:
+        for callee in references[name]:
+            fan_in[callee] += 1
+
+    # Depth and number of the commands executed by a single call (None if
+    # the function can run into an infinite recursion). The components are
+    # in reverse topological order, so the callees are always evaluated
+    # before the callers.
+    depth: dict[str, Optional[int]] = {}
+    commands_per_call: dict[str, Optional[int]] = {}
+    cycles: list[list[str]] = []
+    recursive: set[str] = set()
+    for component in strongly_connected_components(calls):
+        if len(component) > 1 or component[0] in calls[component[0]]:
+            cycles.append(sorted(component))
+            recursive.update(component)
+            for name in component:
+                depth[name] = None
+                commands_per_call[name] = None
+            continue
+        name = component[0]
+        callee_depths = [depth[c] for c in calls[name]]
+        callee_commands = [commands_per_call[c] for c in calls[name]]
+        if None in callee_depths:
+            depth[name] = None
+            commands_per_call[name] = None
+            continue
+        depth[name] = max(
+            (d + 1 for d in callee_depths if d is not None), default=0)
+        commands_per_call[name] = functions[name].commands + sum(
+            c for c in callee_commands if c is not None)
+
+    reachable = reachable_from(tick_functions + entry_points, references)
+    tick_reachable = reachable_from(tick_functions, calls)
+    # The number of commands executed by the tick functions (None if they
+    # can run into an infinite recursion)
+    tick_commands: Optional[int] = 0
+    for name in tick_functions:
+        commands = commands_per_call[name]
+        if tick_commands is None or commands is None:
+            tick_commands = None
+        else:
+            tick_commands += commands
+    known_depths = [d for d in depth.values() if d is not None]
+    return {
+        "summary": {
+            "functions": len(functions),
+            "commands": sum(info.commands for info in functions.values()),
+            "tick_functions": tick_functions,
+            "entry_points": entry_points,
+            "max_call_depth": max(known_depths, default=0),
+            "max_fan_out": max(
+                (len(references[name]) for name in functions), default=0),
+            "commands_per_tick": tick_commands,
+            "unique_commands_per_tick": sum(
+                functions[name].commands for name in tick_reachable),
+            "cycles": sorted(cycles),
+            "unreachable": sorted(
+                name for name in functions if name not in reachable),
+            "missing": missing,
+        },
+        "functions": {
+            name: {
+                "commands": functions[name].commands,
+                "commands_per_call": commands_per_call[name],
+                "depth": depth[name],
+                "fan_out": len(references[name]),
+                "fan_in": fan_in[name],
+                "recursive": name in recursive,
+                "calls": sorted(set(functions[name].calls)),
+                "schedules": sorted(set(functions[name].schedules)),
+            }
+            for name in sorted(functions)
+        },
+    }
+
+def main():
+    try:
+        config = json.loads(sys.argv[1])
+    except Exception:
+        config = {}
+    if 'output' in config:
+        output = DATA_PATH / config['output']
+    else:
+        output = DATA_PATH / 'mcfunction_call_graph/report.json'
+    # The functions that are called by other means than tick.json (e.g.
+    # command blocks, entities or scripts)
+    if 'entry_points' in config:
+        entry_points = [normalize_name(n) for n in config['entry_points']]
+    else:
+        entry_points = []
+
+    functions: dict[str, FunctionInfo] = {}
+    with profiling.phase('parse'):
+        # Sorted, so the report doesn't depend on the order of the files in
+        # the file system
+        for path in sorted(FUNCTIONS_PATH.rglob('*.mcfunction')):
+            name = path.relative_to(FUNCTIONS_PATH).with_suffix('').as_posix()
+            functions[name] = parse_function(path)
+    profiling.count('functions', len(functions))
+    tick_functions: list[str] = []
+    if TICK_PATH.exists():
+        with TICK_PATH.open('r', encoding='utf8') as f:
+            tick_functions = [
+                normalize_name(n) for n in json.load(f).get('values', [])]
+
+    with profiling.phase('analyze'):
+        report = analyze(functions, tick_functions, entry_points)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with profiling.phase('write'), output.open('w', encoding='utf8') as f:
+        json.dump(report, f, indent='\t', ensure_ascii=False)
+
+    summary = report['summary']
+    print(
+        f"Analyzed {summary['functions']} function(s). "
+        f"Max call depth: {summary['max_call_depth']}, "
+        f"commands per tick: {summary['commands_per_tick']}, "
+        f"cycles: {len(summary['cycles'])}, "
+        f"unreachable functions: {len(summary['unreachable'])}")
+
+if __name__ == '__main__':
+    profiling.run('mcfunction_call_graph', main)
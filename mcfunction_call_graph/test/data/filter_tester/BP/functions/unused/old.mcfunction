@@ -0,0 +1,2 @@
+say Nothing calls this function
+function unused/removed
@@ -0,0 +1,19 @@
+'''
+This script is used for testing mcfunction_call_graph. The filter writes the
+report to the data folder, which isn't checked by the filter_tester, so this
+script copies the report to the behavior pack.
+'''
+from pathlib import Path
+import shutil
+
+REPORT_PATH = Path("data/mcfunction_call_graph/report.json")
+TARGET_PATH = Path("BP/call_graph_report.json")
+
+def main():
+    print(f"Copying the report from {REPORT_PATH} to {TARGET_PATH}")
+    if not REPORT_PATH.exists():
+        raise Exception(f"The report does not exist: {REPORT_PATH}")
+    shutil.copyfile(REPORT_PATH, TARGET_PATH)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+say The area is loaded
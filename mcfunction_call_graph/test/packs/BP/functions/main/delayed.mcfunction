@@ -0,0 +1,2 @@
+say 20 ticks later
+schedule on_area_loaded add 0 0 0 16 0 16 main/area_loaded
@@ -0,0 +1,3 @@
+effect @s speed 1 1 true
+function utils/log
+function utils/log
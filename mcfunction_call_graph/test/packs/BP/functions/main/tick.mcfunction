@@ -0,0 +1,7 @@
+# Runs every tick
+function main/update_players
+execute as @a at @s run function main/player_effects
+execute as @e[type=zombie] at @s run execute if block ~ ~-1 ~ sand run function mobs/zombie
+execute @e[type=skeleton, c=1] ~ ~ ~ detect ~ ~-1 ~ sand 0 function mobs/legacy_skeleton
+schedule delay add main/delayed 20t
+function missing/function
@@ -0,0 +1,2 @@
+scoreboard players add @a time 1
+/function utils/log
@@ -0,0 +1 @@
+say I was found by the legacy execute command
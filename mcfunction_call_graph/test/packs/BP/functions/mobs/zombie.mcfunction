@@ -0,0 +1 @@
+say I'm standing on sand
@@ -0,0 +1,2 @@
+scoreboard players remove @s counter 1
+execute if score @s counter matches 1.. run function recursion/countdown
@@ -0,0 +1,2 @@
+say ping
+execute if score @s counter matches 1.. run function recursion/pong
@@ -0,0 +1,3 @@
+say pong
+scoreboard players remove @s counter 1
+function recursion/ping
@@ -0,0 +1,3 @@
+scoreboard players set @s counter 10
+function recursion/countdown
+function recursion/ping
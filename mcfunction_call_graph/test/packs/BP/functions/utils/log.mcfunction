@@ -0,0 +1 @@
+scoreboard players add #log calls 1
@@ -1,9 +1,18 @@
 from pathlib import Path
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import deque
+from typing import Any, BinaryIO, Iterator, NamedTuple, Optional
+from fnmatch import fnmatchcase
 import zipfile
+import zlib
+import bz2
+import time
+import struct
 import sys
 import json
 import os
 import subprocess
+import profiling
 
 PROJECT_PATH = Path(os.environ['ROOT_DIR'])
 
@@ -23,8 +32,291 @@ def get_git_tag():
     except:
         return 'unknown'
 
-def main():
-    config = json.loads(sys.argv[1])
+# The format of the local file header of the ZIP file (see the ZIP
+# specification)
+LOCAL_HEADER_FORMAT = '<4s2B4HL2L2H'
+LOCAL_HEADER_SIZE = struct.calcsize(LOCAL_HEADER_FORMAT)
+
+COMPRESSION_METHODS = {
+    'stored': zipfile.ZIP_STORED,
+    'deflated': zipfile.ZIP_DEFLATED,
+    'bzip2': zipfile.ZIP_BZIP2,
+    'lzma': zipfile.ZIP_LZMA,
+}
+
+# The default compression policy, used for the files that don't match any
+# of the rules from the 'compression' setting. Compressing the files that
+# are already compressed is a waste of time.
+DEFAULT_COMPRESSION: dict[str, Any] = {
+    '*.png': 'stored',
+    '*.jpg': 'stored',
+    '*.jpeg': 'stored',
+    '*.ogg': 'stored',
+    '*.mp3': 'stored',
+    '*.fsb': 'stored',
+    '*.ldb': 'stored',  # The blocks of the world database are compressed
+    '*.zip': 'stored',
+    '*.mcpack': 'stored',
+    '*.mcaddon': 'stored',
+    '*.mcworld': 'stored',
+    '*.mctemplate': 'stored',
+}
+
+class Compression(NamedTuple):
+    '''The compression method and level of a file.'''
+    method: int
+    level: Optional[int]
+
+    @property
+    def flag_bits(self) -> int:
+        '''
+        The bits of the general purpose flag of the ZIP entry that describe
+        the compression options (see the ZIP specification).
+        '''
+        if self.method == zipfile.ZIP_LZMA:
+            return 0x02  # The data has the end-of-stream marker
+        if self.method != zipfile.ZIP_DEFLATED or self.level is None:
+            return 0
+        if self.level >= 8:
+            return 0x02  # Maximum compression
+        if self.level == 2:
+            return 0x04  # Fast compression
+        if self.level == 1:
+            return 0x06  # Super fast compression
+        return 0
+
+def parse_compression(rules: dict[str, Any]) -> list[tuple[str, Compression]]:
+    '''
+    Parses the compression policy. The keys of the rules are the glob
+    patterns and the values are the names of the compression methods or
+    objects with the "method" and "level" properties. The patterns are
+    converted to lowercase (see get_compression).
+    '''
+    result: list[tuple[str, Compression]] = []
+    for pattern, rule in rules.items():
+        if isinstance(rule, str):
+            rule = {'method': rule}
+        method = rule.get('method', 'deflated')
+        if method not in COMPRESSION_METHODS:
+            raise ValueError(
+                f"Unknown compression method '{method}' in the rule for "
+                f"'{pattern}'. Valid methods are: "
+                f"{', '.join(COMPRESSION_METHODS)}")
+        result.append((
+            pattern.lower(),
+            Compression(COMPRESSION_METHODS[method], rule.get('level'))))
+    return result
+
+def get_compression(
+        path_in_zip: str, policy: list[tuple[str, Compression]]
+) -> Compression:
+    '''
+    Returns the compression of the first rule of the policy that matches the
+    path in the archive. The matching is case-insensitive (the file
+    extensions like ".PNG" are common). The files that don't match any of the
+    rules are deflated with the default compression level.
+    '''
+    path_in_zip = path_in_zip.lower()
+    for pattern, compression in policy:
+        if fnmatchcase(path_in_zip, pattern):
+            return compression
+    return Compression(zipfile.ZIP_DEFLATED, None)
+
+class CompressedFile(NamedTuple):
+    '''
+    The data of a file compressed by compress_file. The data is None if the
+    compressed data can be copied from the previous archive.
+    '''
+    data: Optional[bytes]
+    crc: int
+    file_size: int
+    compression: Compression
+
+def can_reuse(
+        previous: Optional[zipfile.ZipInfo],
+        previous_zf: Optional[zipfile.ZipFile], data: bytes, crc: int,
+        compression: Compression) -> bool:
+    '''
+    Checks if the compressed data of the entry of the previous archive can be
+    used for the file with given data and compression. The CRC and the size
+    of the entry are only a quick check, the data of the entry is compared
+    with the file byte by byte (the CRC collisions are easy to make).
+    '''
+    if (
+            previous is None or previous_zf is None or
+            previous.compress_type != compression.method or
+            # Not encrypted and compressed with the same options
+            previous.flag_bits & 0x07 != compression.flag_bits or
+            previous.CRC != crc or
+            previous.file_size != len(data)):
+        return False
+    try:
+        # Decompressing is much faster than compressing
+        return previous_zf.read(previous) == data
+    except (zipfile.BadZipFile, zlib.error, EOFError, OSError):
+        return False
+
+def read_raw(fp: BinaryIO, zinfo: zipfile.ZipInfo) -> bytes:
+    '''
+    Reads the compressed data of the entry of the archive.
+    '''
+    fp.seek(zinfo.header_offset)
+    header = struct.unpack(LOCAL_HEADER_FORMAT, fp.read(LOCAL_HEADER_SIZE))
+    if header[0] != b'PK\x03\x04':
+        raise zipfile.BadZipFile(
+            f"Bad local file header of {zinfo.filename}")
+    # Skip the file name and the extra field
+    fp.seek(header[10] + header[11], os.SEEK_CUR)
+    return fp.read(zinfo.compress_size)
+
+def compress(data: bytes, compression: Compression) -> bytes:
+    '''
+    Compresses the data in the same way as ZipFile.write with the same
+    compression method and level.
+    '''
+    method, level = compression
+    if method == zipfile.ZIP_STORED:
+        return data
+    compressor: Any
+    if method == zipfile.ZIP_DEFLATED:
+        compressor = zlib.compressobj(
+            zlib.Z_DEFAULT_COMPRESSION if level is None else level,
+            zlib.DEFLATED, -15)
+    elif method == zipfile.ZIP_BZIP2:
+        compressor = bz2.BZ2Compressor(9 if level is None else level)
+    else:
+        compressor = zipfile.LZMACompressor()
+    return compressor.compress(data) + compressor.flush()
+
+def compress_file(
+        path: Path, compression: Compression,
+        previous: Optional[zipfile.ZipInfo]=None,
+        previous_zf: Optional[zipfile.ZipFile]=None) -> CompressedFile:
+    '''
+    Reads and compresses the file. Runs in the threads of the pool (the
+    compression libraries release the GIL). The file isn't compressed if its
+    content is the same as the content of the previous entry from the
+    previous_zf archive.
+    '''
+    with profiling.phase('read'):
+        data = path.read_bytes()
+    crc = zlib.crc32(data)
+    if can_reuse(previous, previous_zf, data, crc, compression):
+        return CompressedFile(None, crc, len(data), compression)
+    with profiling.phase('compress'):
+        return CompressedFile(
+            compress(data, compression), crc, len(data), compression)
+
+def write_compressed(
+        zf: zipfile.ZipFile, zinfo: zipfile.ZipInfo, file: CompressedFile):
+    '''
+    Writes the already compressed file to the archive.
+    '''
+    zinfo.compress_type = file.compression.method
+    zinfo.flag_bits = file.compression.flag_bits
+    zinfo.CRC = file.crc
+    zinfo.file_size = file.file_size
+    assert file.data is not None
+    zinfo.compress_size = len(file.data)
+    zinfo.header_offset = zf.fp.tell()
+    zf.fp.write(zinfo.FileHeader())
+    zf.fp.write(file.data)
+    zf.filelist.append(zinfo)
+    zf.NameToInfo[zinfo.filename] = zinfo
+    zf.start_dir = zf.fp.tell()
+
+def scan_directory(
+        path: Path, scan_cache: dict[Path, list[tuple[Path, bool]]]
+) -> list[tuple[Path, bool]]:
+    '''
+    Returns the list of the paths in the directory with the information if
+    they're files. Every directory is scanned only once per run (the results
+    are stored in the scan_cache).
+    '''
+    if path not in scan_cache:
+        scan_cache[path] = [(file, file.is_file()) for file in path.rglob('*')]
+    return scan_cache[path]
+
+def list_entries(
+        pathmap: list[tuple[Path, Path]],
+        scan_cache: dict[Path, list[tuple[Path, bool]]]
+) -> list[tuple[Optional[Path], str]]:
+    '''
+    Lists the entries of the archive. Returns a list of tuples with the path
+    of the file on disk and the path in the archive. The path on disk is None
+    for the directories.
+    '''
+    entries: list[tuple[Optional[Path], str]] = []
+    for path_on_disk, path_in_zip in pathmap:
+        if path_on_disk.is_file():
+            entries.append((path_on_disk, path_in_zip.as_posix()))
+            continue
+        if Path(path_in_zip) != Path('.'):
+            entries.append((None, path_in_zip.as_posix()))
+        for file, is_file in scan_directory(path_on_disk, scan_cache):
+            out_path = (
+                path_in_zip / file.relative_to(path_on_disk)).as_posix()
+            if is_file:
+                entries.append((file, out_path))
+                continue
+            entries.append((None, out_path))
+    return entries
+
+def compress_files(
+        files: list[tuple[Path, Compression, Optional[zipfile.ZipInfo]]],
+        threads: int,
+        previous_zf: Optional[zipfile.ZipFile]=None
+) -> Iterator[CompressedFile]:
+    '''
+    Compresses the files in a thread pool and yields the results in the same
+    order as the files. The files are paired with their compression and the
+    entries of the previous archive (the previous_zf) or None. Only a limited
+    number of files is compressed ahead of the one that is currently yielded,
+    so the memory usage stays low.
+    '''
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        pending: deque[Future[CompressedFile]] = deque()
+        for file, compression, previous in files:
+            if len(pending) >= threads * 4:
+                yield pending.popleft().result()
+            pending.append(pool.submit(
+                compress_file, file, compression, previous, previous_zf))
+        while len(pending) > 0:
+            yield pending.popleft().result()
+
+def reproducible_date_time() -> tuple[int, int, int, int, int, int]:
+    '''
+    Returns the timestamp of the entries of the reproducible archives. It's
+    taken from the SOURCE_DATE_EPOCH environment variable if it's set,
+    otherwise it's the earliest date supported by the ZIP format.
+    '''
+    if 'SOURCE_DATE_EPOCH' in os.environ:
+        date_time = time.gmtime(int(os.environ['SOURCE_DATE_EPOCH']))
+        if date_time.tm_year >= 1980:
+            return (
+                date_time.tm_year, date_time.tm_mon, date_time.tm_mday,
+                date_time.tm_hour, date_time.tm_min, date_time.tm_sec)
+    return (1980, 1, 1, 0, 0, 0)
+
+class PackedFile(NamedTuple):
+    '''
+    A file packed into one of the archives created in this run. The other
+    archives copy its compressed data instead of compressing the file again.
+    '''
+    archive: Path
+    zinfo: zipfile.ZipInfo
+
+def pack(
+        config: dict[str, Any], threads: int,
+        scan_cache: dict[Path, list[tuple[Path, bool]]],
+        packed: dict[tuple[Path, Compression], PackedFile],
+        archive_fps: dict[Path, BinaryIO]):
+    '''
+    Creates one of the output archives. The packed dictionary maps the files
+    and their compression to the files packed into the archives created
+    earlier in this run. The archive_fps are the opened files of these
+    archives.
+    '''
     output_str = config['output']
     if output_str.startswith('`') and output_str.endswith('`'):
         output_str = output_str[1:-1]
@@ -32,26 +324,155 @@ def main():
 
     output: Path = Path(PROJECT_PATH) / output_str
     output.parent.mkdir(parents=True, exist_ok=True)
+    if output in archive_fps:
+        raise ValueError(f"The output {output_str} is used more than once.")
 
     # [path_on_disk, path_in_zip]
     pathmap: list[tuple[Path, Path]] = [
         (resolver_input_path(k), Path(v))
         for k, v in config['pathmap'].items()
     ]
-    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as zf:
-        for path_on_disk, path_in_zip in pathmap:
-            if path_on_disk.is_file():
-                zf.write(path_on_disk, path_in_zip)
-                continue
-            if Path(path_in_zip) != Path('.'):
-                zf.mkdir(path_in_zip.as_posix())
-            for file in path_on_disk.rglob('*'):
-                out_path = (
-                    path_in_zip / file.relative_to(path_on_disk)).as_posix()
-                if file.is_file():
-                    zf.write(file, out_path)
+    # Reuse the compressed data of the unchanged files from the previous
+    # archive
+    incremental: bool = config.get('incremental', False)
+    # The rules from the settings are checked before the default ones
+    compression_policy = (
+        parse_compression(config.get('compression', {})) +
+        parse_compression(DEFAULT_COMPRESSION))
+    # Sorted entries with fixed timestamps and permissions, so the same files
+    # always produce the same archive
+    reproducible: bool = config.get('reproducible', False)
+
+    with profiling.phase('scan'):
+        entries = [
+            (
+                path_on_disk, path_in_zip,
+                None if path_on_disk is None else
+                get_compression(path_in_zip, compression_policy)
+            )
+            for path_on_disk, path_in_zip in list_entries(pathmap, scan_cache)
+        ]
+    if reproducible:
+        entries.sort(key=lambda entry: entry[1])
+    previous_fp: Optional[BinaryIO] = None
+    previous_zf: Optional[zipfile.ZipFile] = None
+    previous_entries: dict[str, zipfile.ZipInfo] = {}
+    if incremental and output.is_file():
+        # The compressed data is copied using the previous_fp, the content of
+        # the entries is compared in the threads using the previous_zf (it
+        # has its own file handle)
+        previous_fp = output.open('rb')
+        try:
+            previous_zf = zipfile.ZipFile(output)
+            previous_entries = {
+                zinfo.filename: zinfo for zinfo in previous_zf.infolist()}
+        except zipfile.BadZipFile:
+            pass  # The archive will be created from scratch
+    # The archive is written to a temporary file, because the previous
+    # archive may be still in use.
+    tmp_output = output.with_name(output.name + '.tmp')
+    # The files are compressed in parallel, but they're written in the same
+    # order as they're listed, so the archive is always the same. The files
+    # packed into the other archives aren't compressed again.
+    compressed = compress_files([
+        (path_on_disk, compression, previous_entries.get(path_in_zip))
+        for path_on_disk, path_in_zip, compression in entries
+        if path_on_disk is not None and compression is not None and
+        (path_on_disk, compression) not in packed
+    ], threads, previous_zf)
+    date_time = reproducible_date_time()
+    reused, shared = 0, 0
+    new_packed: dict[tuple[Path, Compression], zipfile.ZipInfo] = {}
+    try:
+        # Includes the time of waiting for the compressed files
+        with profiling.phase('write'), zipfile.ZipFile(
+                tmp_output, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for path_on_disk, path_in_zip, compression in entries:
+                if path_on_disk is None or compression is None:
+                    if reproducible:
+                        zinfo = zipfile.ZipInfo(
+                            path_in_zip.rstrip('/') + '/', date_time)
+                        zinfo.create_system = 3  # Unix
+                        zinfo.external_attr = (0o40755 << 16) | 0x10
+                        zinfo.compress_size = 0
+                        zinfo.CRC = 0
+                        zf.mkdir(zinfo)
+                    else:
+                        zf.mkdir(path_in_zip)
                     continue
-                zf.mkdir(out_path)
+                zinfo = zipfile.ZipInfo.from_file(path_on_disk, path_in_zip)
+                if reproducible:
+                    zinfo.date_time = date_time
+                    zinfo.create_system = 3  # Unix
+                    zinfo.external_attr = 0o100644 << 16
+                key = (path_on_disk, compression)
+                if key in packed:
+                    packed_file = packed[key]
+                    file = CompressedFile(
+                        read_raw(
+                            archive_fps[packed_file.archive],
+                            packed_file.zinfo),
+                        packed_file.zinfo.CRC, packed_file.zinfo.file_size,
+                        compression)
+                    shared += 1
+                else:
+                    file = next(compressed)
+                    if file.data is None:
+                        assert previous_fp is not None
+                        file = file._replace(data=read_raw(
+                            previous_fp, previous_entries[path_in_zip]))
+                        reused += 1
+                    new_packed.setdefault(key, zinfo)
+                write_compressed(zf, zinfo, file)
+    except BaseException:
+        # Don't leave the incomplete archive next to the output
+        compressed.close()
+        tmp_output.unlink(missing_ok=True)
+        raise
+    finally:
+        if previous_zf is not None:
+            previous_zf.close()
+        if previous_fp is not None:
+            previous_fp.close()
+    os.replace(tmp_output, output)
+    archive_fps[output] = output.open('rb')
+    for key, zinfo in new_packed.items():
+        packed[key] = PackedFile(output, zinfo)
+    profiling.count('archives')
+    profiling.count('files', sum(
+        1 for _, _, compression in entries if compression is not None))
+    profiling.count('reused_files', reused)
+    profiling.count('shared_files', shared)
+    if incremental:
+        print(
+            f"{output_str}: reused {reused} compressed file(s) from the "
+            "previous archive")
+    if shared > 0:
+        print(
+            f"{output_str}: copied {shared} compressed file(s) from the "
+            "other outputs")
+
+def main():
+    config = json.loads(sys.argv[1])
+    # Number of threads used for compressing the files (0 - CPU count)
+    threads: int = config.get('threads', 0)
+    if threads == 0:
+        threads = os.cpu_count() or 1
+    # Every output inherits the settings that it doesn't define
+    if 'outputs' in config:
+        outputs = [config | output for output in config['outputs']]
+    else:
+        outputs = [config]
+
+    scan_cache: dict[Path, list[tuple[Path, bool]]] = {}
+    packed: dict[tuple[Path, Compression], PackedFile] = {}
+    archive_fps: dict[Path, BinaryIO] = {}
+    try:
+        for output in outputs:
+            pack(output, threads, scan_cache, packed, archive_fps)
+    finally:
+        for fp in archive_fps.values():
+            fp.close()
 
 if __name__ == '__main__':
-    main()
+    profiling.run('pack_anything', main)
@@ -0,0 +1,2 @@
+say reset
+scoreboard objectives add reset dummy
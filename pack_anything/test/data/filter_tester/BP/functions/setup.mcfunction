@@ -0,0 +1,2 @@
+say setup
+scoreboard objectives add setup dummy
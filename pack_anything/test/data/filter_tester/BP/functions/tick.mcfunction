@@ -0,0 +1,2 @@
+say tick
+scoreboard objectives add tick dummy
@@ -0,0 +1,82 @@
+'''
+This script is used for testing pack_anything. It checks the archives
+created by the filter.
+
+Settings:
+- content - maps the paths of the archives (relative to the project) to the
+  expected content. The content is described like the pathmap of the filter
+  (the paths on disk mapped to the paths in the archive). The archive must
+  contain exactly the same files, with the same data.
+- identical - a list of the lists of the archives that must be
+  byte-identical.
+- compression - maps the paths of the archives to the expected compression
+  methods of their entries ("stored" or "deflated").
+'''
+from pathlib import Path
+import json
+import os
+import sys
+import zipfile
+
+PROJECT_PATH = Path(os.environ['ROOT_DIR'])
+
+COMPRESSION_METHODS = {
+    'stored': zipfile.ZIP_STORED,
+    'deflated': zipfile.ZIP_DEFLATED,
+}
+
+def expected_files(pathmap: dict[str, str]) -> dict[str, Path]:
+    '''
+    Returns the paths in the archive mapped to the paths of the files on disk.
+    '''
+    result: dict[str, Path] = {}
+    for path_on_disk, path_in_zip in pathmap.items():
+        source = Path(path_on_disk)
+        if source.is_file():
+            result[Path(path_in_zip).as_posix()] = source
+            continue
+        for file in source.rglob('*'):
+            if file.is_file():
+                result[
+                    (Path(path_in_zip) / file.relative_to(source)).as_posix()
+                ] = file
+    return result
+
+def main():
+    config = json.loads(sys.argv[1])
+    for archives in config.get('identical', []):
+        print(f"Checking if the archives are identical: {archives}")
+        first = (PROJECT_PATH / archives[0]).read_bytes()
+        for archive in archives[1:]:
+            if (PROJECT_PATH / archive).read_bytes() != first:
+                raise Exception(
+                    f"The archives are different: {archives[0]}, {archive}")
+    for archive, pathmap in config.get('content', {}).items():
+        print(f"Checking the content of: {archive}")
+        expected = expected_files(pathmap)
+        with zipfile.ZipFile(PROJECT_PATH / archive) as zf:
+            files = {
+                zinfo.filename: zinfo for zinfo in zf.infolist()
+                if not zinfo.is_dir()}
+            if files.keys() != expected.keys():
+                raise Exception(
+                    f"Unexpected files in {archive}:\n"
+                    f"Missing: {sorted(expected.keys() - files.keys())}\n"
+                    f"Extra: {sorted(files.keys() - expected.keys())}")
+            for name, path in expected.items():
+                # Also checks the CRC of the entry
+                if zf.read(files[name]) != path.read_bytes():
+                    raise Exception(
+                        f"The content of {name} in {archive} is different "
+                        f"from {path}")
+    for archive, methods in config.get('compression', {}).items():
+        print(f"Checking the compression of the files in: {archive}")
+        with zipfile.ZipFile(PROJECT_PATH / archive) as zf:
+            for name, method in methods.items():
+                zinfo = zf.getinfo(name)
+                if zinfo.compress_type != COMPRESSION_METHODS[method]:
+                    raise Exception(
+                        f"The {name} file in {archive} should be {method}")
+
+if __name__ == "__main__":
+    main()
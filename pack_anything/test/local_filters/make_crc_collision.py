@@ -0,0 +1,58 @@
+'''
+This script is used for testing the incremental mode of pack_anything. It
+changes the content of a file without changing its size and CRC32, so the
+filter can't use these values to decide if the file changed.
+
+The first byte of the file is changed and the last 4 bytes are replaced with
+the bytes that restore the original CRC32.
+
+Settings:
+- path - the path to the file to change.
+'''
+from pathlib import Path
+import json
+import sys
+import zlib
+
+def forge_suffix(prefix: bytes, crc: int) -> bytes:
+    '''
+    Returns 4 bytes which appended to the prefix give the data with given
+    CRC32. The CRC of the data of fixed length is an affine function of its
+    bits, so the bytes are found by solving a system of linear equations over
+    GF(2).
+    '''
+    base = zlib.crc32(prefix + bytes(4))
+    zero = zlib.crc32(bytes(len(prefix) + 4))
+    # The rows are (the effect of the bit on the CRC, the bit)
+    rows = [
+        (zlib.crc32(bytes(len(prefix)) + (1 << i).to_bytes(4, 'little'))
+            ^ zero, 1 << i)
+        for i in range(32)]
+    target = crc ^ base
+    solution = 0
+    for bit in range(32):
+        mask = 1 << bit
+        pivot = next(i for i, row in enumerate(rows) if row[0] & mask)
+        pivot_row = rows.pop(pivot)
+        rows = [
+            (effect ^ pivot_row[0], x ^ pivot_row[1])
+            if effect & mask else (effect, x)
+            for effect, x in rows]
+        if target & mask:
+            target ^= pivot_row[0]
+            solution ^= pivot_row[1]
+    return solution.to_bytes(4, 'little')
+
+def main():
+    config = json.loads(sys.argv[1])
+    path = Path(config['path'])
+    data = path.read_bytes()
+    crc = zlib.crc32(data)
+    changed = bytes([data[0] ^ 0x20]) + data[1:-4]
+    changed += forge_suffix(changed, crc)
+    assert changed != data and zlib.crc32(changed) == crc
+    print(f"Changing {path} without changing its size and CRC32")
+    path.write_bytes(changed)
+
+if __name__ == "__main__":
+    main()
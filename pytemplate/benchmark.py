@@ -0,0 +1,369 @@
+'''
+Benchmarks of the pytemplate filter. Run from the directory of the filter:
+    python benchmark.py [templates] [merge]
+
+The results of the current implementation of replace_templates are compared
+with the original implementation (based on repeated walks of the whole
+document) to make sure that they produce identical output. The results of
+the merge engine (merge.py) are compared with the original implementations
+of pytemplate and system_template (the current implementation keeps the
+order of the keys like the latter).
+'''
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from copy import deepcopy
+import json
+import math
+import sys
+import time
+import merge
+from main import replace_templates
+from template_cache import TemplateCache
+from template_memo import TemplateMemo
+
+TRIGGER = 'TEMPLATE'
+SCOPE = {'true': True, 'false': False, 'math': math}
+
+# The original implementation of replace_templates
+
+def legacy_walk_json(data, json_path=None):
+    if json_path is None:
+        json_path = []
+    if isinstance(data, dict):
+        for k in data.keys():
+            curr_path = json_path + [k]
+            if isinstance(data[k], (dict, list)):
+                yield from legacy_walk_json(data[k], json_path=curr_path)
+            yield tuple(curr_path)
+    elif isinstance(data, list):
+        for i in range(len(data)):
+            curr_path = json_path + [i]
+            if isinstance(data[i], (dict, list)):
+                yield from legacy_walk_json(data[i], json_path=curr_path)
+            yield tuple(curr_path)
+
+def legacy_access_json(data, path):
+    if len(path) == 0:
+        return data
+    return legacy_access_json(data[path[0]], path[1:])
+
+def legacy_replace_templates(data, scope, templates, trigger_phrase):
+    points_of_interset = []
+    for poi in legacy_walk_json(data):
+        k = poi[-1]
+        if isinstance(k, str) and k.startswith(trigger_phrase):
+            points_of_interset.append(poi)
+    if len(points_of_interset) == 0:
+        return data, False
+    for poi in sorted(points_of_interset):
+        try:
+            k = poi[-1]
+            template_name = k.split(":", 1)[1]
+            template = templates[template_name]
+        except KeyError as e:
+            raise RuntimeError(f"Unable to read template {k}") from e
+        if len(poi) == 1:
+            try:
+                curr_scope = scope | data[poi[0]]
+            except KeyError:
+                continue
+            del data[poi[0]]
+            data = merge.deep_merge_objects(
+                a=eval(template, curr_scope),
+                b=data,
+                list_merge_policy=merge.ListMergePolicy.APPEND)
+            data, _ = legacy_replace_templates(
+                data, curr_scope, templates, trigger_phrase)
+        else:
+            parent = legacy_access_json(data, poi[:-2])
+            try:
+                curr_scope = scope | legacy_access_json(parent, poi[-2:])
+            except KeyError:
+                continue
+            del parent[poi[-2]][poi[-1]]
+            parent[poi[-2]] = merge.deep_merge_objects(
+                a=eval(template, curr_scope),
+                b=parent[poi[-2]],
+                list_merge_policy=merge.ListMergePolicy.APPEND)
+            parent[poi[-2]], _ = legacy_replace_templates(
+                parent[poi[-2]], curr_scope, templates, trigger_phrase)
+    return data, True
+
+# The original implementations of the merge of pytemplate (unordered keys)
+# and system_template (ordered keys)
+
+def legacy_pt_deep_merge_objects(a, b, list_merge_policy):
+    if type(a) != type(b):
+        return b
+    if isinstance(a, dict):
+        return legacy_pt_deep_merge_dicts(a, b, list_merge_policy)
+    elif isinstance(a, list):
+        return legacy_deep_merge_lists(
+            a, b, list_merge_policy, legacy_pt_deep_merge_objects)
+    return b
+
+def legacy_pt_deep_merge_dicts(a, b, list_merge_policy):
+    result = {}
+    for k in (a.keys() | b.keys()):
+        if k in b:
+            if k not in a:
+                result[k] = b[k]
+                continue
+            result[k] = legacy_pt_deep_merge_objects(
+                a[k], b[k], list_merge_policy)
+        elif k in a:
+            result[k] = a[k]
+    return result
+
+def legacy_st_deep_merge_objects(a, b, list_merge_policy):
+    if type(a) != type(b):
+        return b
+    if isinstance(a, dict):
+        return legacy_st_deep_merge_dicts(a, b, list_merge_policy)
+    elif isinstance(a, list):
+        return legacy_deep_merge_lists(
+            a, b, list_merge_policy, legacy_st_deep_merge_objects)
+    return b
+
+def legacy_st_deep_merge_dicts(a, b, list_merge_policy):
+    result = {}
+    keys = list(a.keys()) + list(b.keys())
+    used_keys = set()
+    for k in keys:
+        if k in used_keys:
+            continue
+        used_keys.add(k)
+        if k in b:
+            if k not in a:
+                result[k] = b[k]
+                continue
+            result[k] = legacy_st_deep_merge_objects(
+                a[k], b[k], list_merge_policy)
+        elif k in a:
+            result[k] = a[k]
+    return result
+
+def legacy_deep_merge_lists(a, b, list_merge_policy, merge_objects):
+    # The same in both filters (except for the recursive call)
+    list_len = max(len(a), len(b))
+    if list_merge_policy is merge.ListMergePolicy.SMALLER_LENGHT:
+        list_len = min(len(a), len(b))
+    elif list_merge_policy is merge.ListMergePolicy.B_LENGHT:
+        list_len = len(b)
+    elif list_merge_policy is merge.ListMergePolicy.APPEND:
+        for b_item in b:
+            a.append(b_item)
+        return a
+    result = [None]*list_len
+    for i in range(list_len):
+        if i < len(b):
+            if i >= len(a):
+                result[i] = b[i]
+                continue
+            result[i] = merge_objects(a[i], b[i], list_merge_policy)
+        elif i < len(a):
+            result[i] = a[i]
+    return result
+
+# Test data
+
+TEMPLATES = {
+    'component': '{f"minecraft:{name}": {"value": value}}',
+    'variants': (
+        '{"component_groups": {f"variant_{i}": {"minecraft:variant": '
+        '{"value": i}} for i in range(count)}, "tags": [name]}'),
+    'nested': '{"inner": {"TEMPLATE:component": {"value": value * 2}}}',
+    'physics': (
+        '{"components": {f"minecraft:c{i:03}": {"value": math.fsum('
+        'math.sqrt(j) for j in range(i * scale))} for i in range(size)}}'),
+}
+
+def deep_document(depth: int) -> Dict[str, Any]:
+    '''A chain of nested objects with references to templates on every level.'''
+    root: Dict[str, Any] = {}
+    node = root
+    for i in range(depth):
+        node['TEMPLATE:component'] = {'name': f'level_{i}', 'value': i}
+        node[f'TEMPLATE_{i}:nested'] = {'value': i}
+        node['tags'] = [f'tag_{i}']
+        child: Dict[str, Any] = {}
+        node['child'] = child
+        node = child
+    return root
+
+def wide_document(width: int) -> Dict[str, Any]:
+    '''An object with many references to templates in the same object.'''
+    components: Dict[str, Any] = {}
+    for i in range(width):
+        components[f'minecraft:plain_{i}'] = {'value': i, 'list': [i, i + 1]}
+        components[f'TEMPLATE_{i:04}:component'] = {
+            'name': f'generated_{i}', 'value': i}
+        components[f'TEMPLATE_{i:04}x:variants'] = {
+            'name': f'tag_{i}', 'count': 3}
+    return {
+        'format_version': '1.17.0',
+        'minecraft:entity': {'components': components}
+    }
+
+def repeated_document(count: int) -> Dict[str, Any]:
+    '''Many references to the same template with the same scope.'''
+    return {
+        'format_version': '1.17.0',
+        'entities': [
+            {'TEMPLATE:physics': {'size': 40, 'scale': 20}, 'id': i}
+            for i in range(count)]
+    }
+
+def behavior_document(groups: int, offset: int=0) -> Dict[str, Any]:
+    '''A behavior file with many component groups and events.'''
+    return {
+        'format_version': '1.17.0',
+        'minecraft:entity': {
+            'description': {'identifier': 'ns:entity'},
+            'component_groups': {
+                f'group_{i}': {
+                    'minecraft:variant': {'value': i},
+                    'minecraft:damage_sensor': {'triggers': [
+                        {'cause': 'fall', 'deals_damage': False},
+                        {'cause': 'fire', 'damage_multiplier': i}]}
+                } for i in range(offset, offset + groups)
+            },
+            'events': {
+                f'event_{i}': {'add': {'component_groups': [f'group_{i}']}}
+                for i in range(offset, offset + groups)
+            }
+        }
+    }
+
+def disjoint_documents(size: int) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    '''Two objects without common keys.'''
+    return (
+        {f'a_{i}': {'value': i} for i in range(size)},
+        {f'b_{i}': {'value': i} for i in range(size)})
+
+def list_documents(size: int) -> Tuple[List[Any], List[Any]]:
+    '''Two lists of objects with different lengths.'''
+    return (
+        [{'a': i, 'list': [i]} for i in range(size)],
+        [{'b': i, 'list': [i, i]} for i in range(size // 2)])
+
+def nested_document(depth: int, key: str) -> Dict[str, Any]:
+    '''A chain of nested objects.'''
+    root: Dict[str, Any] = {}
+    node = root
+    for i in range(depth):
+        node[key] = i
+        node['child'] = {}
+        node = node['child']
+    return root
+
+# Benchmark
+
+def run(
+        name: str, func: Callable[..., Tuple[Any, bool]], data: Any,
+        templates: Dict[str, Any], repeat: int) -> Tuple[float, str]:
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        data_copy = deepcopy(data)
+        start = time.perf_counter()
+        result, _ = func(data_copy, SCOPE, templates, TRIGGER)
+        best = min(best, time.perf_counter() - start)
+    print(f'  {name:<10} {best * 1000:10.2f} ms')
+    return best, json.dumps(result)
+
+def benchmark_templates(repeat: int=3):
+    cache = TemplateCache()
+    templates = {
+        k: cache.compile(v, f'{k}.py') for k, v in TEMPLATES.items()}
+    for name, data in [
+            ('deep (50 levels)', deep_document(50)),
+            ('deep (150 levels)', deep_document(150)),
+            ('wide (100 references)', wide_document(50)),
+            ('wide (400 references)', wide_document(200)),
+            ('repeated (200 references)', repeated_document(200))]:
+        print(f'{name}:')
+        legacy_time, legacy_result = run(
+            'legacy', legacy_replace_templates, data, templates, repeat)
+        new_time, new_result = run(
+            'current', replace_templates, data, templates, repeat)
+        if legacy_result != new_result:
+            raise AssertionError(f'Different results for {name}')
+        print(f'  speedup    {legacy_time / new_time:10.1f}x')
+        # Every run starts with an empty memo
+        memos: List[TemplateMemo] = []
+        def memoized(*args):
+            memos.append(TemplateMemo(1000, set(), SCOPE))
+            return replace_templates(*args, memo=memos[-1])
+        _, memo_result = run('memoized', memoized, data, templates, repeat)
+        if legacy_result != memo_result:
+            raise AssertionError(f'Different memoized results for {name}')
+        memo = memos[-1]
+        print(
+            f'  memo       {memo.hits} hit(s), {memo.misses} miss(es), '
+            f'{memo.skipped} skipped')
+
+def run_merge(
+        name: str, func: Callable[..., Any], a: Any, b: Any,
+        policy: merge.ListMergePolicy, repeat: int
+) -> Tuple[Optional[float], Any]:
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        a_copy, b_copy = a, b
+        if policy is merge.ListMergePolicy.APPEND:
+            # APPEND modifies the lists of A
+            a_copy, b_copy = deepcopy((a, b))
+        start = time.perf_counter()
+        try:
+            result = func(a_copy, b_copy, policy)
+        except RecursionError:
+            print(f'  {name:<10} RecursionError')
+            return None, None
+        best = min(best, time.perf_counter() - start)
+    print(f'  {name:<10} {best * 1000:10.3f} ms')
+    return best, result
+
+def benchmark_merge(repeat: int=20):
+    policy = merge.ListMergePolicy
+    for name, (a, b), policies in [
+            ('behavior file (200 + 100 groups)', (
+                behavior_document(200), behavior_document(100, 150)),
+                [policy.GREATER_LENGHT, policy.APPEND]),
+            ('disjoint keys (2000 + 2000)', disjoint_documents(2000),
+                [policy.GREATER_LENGHT]),
+            ('empty B (2000 keys)', (disjoint_documents(2000)[0], {}),
+                [policy.GREATER_LENGHT]),
+            ('lists (2000 + 1000 items)', list_documents(2000), list(policy)),
+            ('deep (900 levels)', (
+                nested_document(900, 'a'), nested_document(900, 'b')),
+                [policy.GREATER_LENGHT])]:
+        for list_merge_policy in policies:
+            print(f'{name}, {list_merge_policy.name}:')
+            st_time, st_result = run_merge(
+                'system', legacy_st_deep_merge_objects, a, b,
+                list_merge_policy, repeat)
+            pt_time, pt_result = run_merge(
+                'pytemplate', legacy_pt_deep_merge_objects, a, b,
+                list_merge_policy, repeat)
+            new_time, new_result = run_merge(
+                'current', merge.deep_merge_objects, a, b, list_merge_policy,
+                repeat)
+            # The order of the keys of pytemplate merge is random
+            if st_time is not None and (
+                    json.dumps(st_result) != json.dumps(new_result)):
+                raise AssertionError(f'Different results for {name}')
+            if pt_time is not None and pt_result != new_result:
+                raise AssertionError(f'Different results for {name}')
+            for legacy_name, legacy_time in [
+                    ('system', st_time), ('pytemplate', pt_time)]:
+                if legacy_time is not None:
+                    print(
+                        f'  speedup vs {legacy_name:<10} '
+                        f'{legacy_time / new_time:6.1f}x')
+
+if __name__ == '__main__':
+    benchmarks = sys.argv[1:] or ['templates', 'merge']
+    if 'templates' in benchmarks:
+        benchmark_templates()
+    if 'merge' in benchmarks:
+        benchmark_merge()
@@ -0,0 +1,166 @@
+from typing import Any, Dict, List, Optional
+from pathlib import Path
+import hashlib
+import json
+import os
+import shutil
+import time
+from template_cache import prune_cache
+
+MANIFEST_VERSION = 2
+
+# The entries of the manifest and the stored outputs that weren't used for
+# this number of seconds are removed
+MAX_ENTRY_AGE = 30 * 24 * 60 * 60
+# The maximal total size of the stored outputs in bytes. The least recently
+# used outputs are removed first.
+MAX_CACHE_SIZE = 256 * 2**20
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def hash_json(data: Any) -> str:
+    '''Hashes JSON-like data regardless of the order of the keys.'''
+    return hash_bytes(json.dumps(data, sort_keys=True).encode('utf8'))
+
+def store_output(outputs_path: Path, text: str) -> str:
+    '''
+    Stores the text of an output file in the cache and returns its hash. The
+    file is written in the same way as the outputs of the filter, so the
+    cached copy is identical to the output.
+    '''
+    output_hash = hash_bytes(text.encode('utf8'))
+    cached_output = outputs_path / f'{output_hash}.json'
+    try:
+        # The output is already stored, mark it as used
+        os.utime(cached_output)
+    except OSError:
+        outputs_path.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first, other processes may write the same
+        # output at the same time.
+        tmp_path = outputs_path / f'{output_hash}.{os.getpid()}.tmp'
+        with tmp_path.open('w') as f:
+            f.write(text)
+        os.replace(tmp_path, cached_output)
+    return output_hash
+
+class BuildManifest:
+    '''
+    The manifest of the incremental builds. For every processed file, it
+    records the hash of the file, the hashes of the scope and the templates
+    used during its evaluation and the hashes of the produced outputs. The
+    outputs are stored in the "outputs" folder of the cache. If nothing has
+    changed since the last run, the outputs are copied from the cache
+    instead of evaluating the file again.
+
+    The entries are keyed by the settings of the filter, so the entries of
+    the profiles with different settings or patterns don't replace each
+    other. The entries and the outputs that aren't used in a run are kept.
+    They're removed when they get old or when the outputs grow too big.
+    The modification time of a stored output is the time of its last use.
+    '''
+    def __init__(
+            self, cache_path: Path, settings: Dict[str, Any],
+            scope_hash: str, template_hashes: Dict[str, str]):
+        self.manifest_path = cache_path / 'manifest.json'
+        self.outputs_path = cache_path / 'outputs'
+        self.settings_hash = hash_json(settings)
+        self.scope_hash = scope_hash
+        self.template_hashes = template_hashes
+        self.restored = 0
+        self._files: Dict[str, Any] = {}
+        self._new_files: Dict[str, Any] = {}
+        try:
+            manifest = json.loads(
+                self.manifest_path.read_text(encoding='utf8'))
+            if manifest['version'] == MANIFEST_VERSION:
+                self._files = manifest['files']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def restore(self, phase: str, fp: Path, input_hash: str) -> bool:
+        '''
+        Restores the outputs of the file from the cache if the file, the
+        scope and the templates didn't change since the last run. Returns True
+        if the outputs were restored. The phase is the name of the stage of
+        the filter that processes the file (the same file can be processed
+        by multiple stages).
+        '''
+        key = self._key(phase, fp)
+        entry = self._files.get(key)
+        if (
+                entry is None or
+                entry['input'] != input_hash or
+                entry['scope'] != self.scope_hash):
+            return False
+        for name, template_hash in entry['templates'].items():
+            if self.template_hashes.get(name) != template_hash:
+                return False
+        for output, output_hash in entry['outputs'].items():
+            if not (self.outputs_path / f'{output_hash}.json').exists():
+                return False
+            if output != fp.as_posix() and Path(output).exists():
+                # The evaluation would skip the existing output (multi-output
+                # templates don't overwrite the files)
+                return False
+        if entry['outputs'] and fp.as_posix() not in entry['outputs']:
+            fp.unlink()  # In-place template with a different output path
+        for output, output_hash in entry['outputs'].items():
+            cached_output = self.outputs_path / f'{output_hash}.json'
+            Path(output).parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(cached_output, output)
+            try:
+                os.utime(cached_output)
+            except OSError:
+                pass  # Removed by another process, the output is copied
+        self._new_files[key] = entry | {'used': int(time.time())}
+        self.restored += 1
+        return True
+
+    def record(
+            self, phase: str, fp: Path, input_hash: str, templates: List[str],
+            outputs: Dict[str, str]):
+        '''
+        Records the result of evaluation of the file. The outputs are the
+        paths of the output files and their hashes (returned by
+        store_output). If the file wasn't modified, the outputs are empty.
+        '''
+        self._new_files[self._key(phase, fp)] = {
+            'used': int(time.time()),
+            'input': input_hash,
+            'scope': self.scope_hash,
+            'templates': {
+                name: self.template_hashes[name] for name in templates},
+            'outputs': outputs,
+        }
+
+    def _key(self, phase: str, fp: Path) -> str:
+        return f'{phase}:{self.settings_hash}:{fp.as_posix()}'
+
+    def save(
+            self, max_age: float=MAX_ENTRY_AGE, max_size: int=MAX_CACHE_SIZE):
+        '''
+        Removes the outputs that weren't used for more than max_age seconds
+        and the least recently used outputs that exceed max_size bytes in
+        total. Saves the manifest with the files processed in this run and
+        the entries of the previous runs which aren't old and still have all
+        of their outputs.
+        '''
+        prune_cache(self.outputs_path.glob('*.json'), max_age, max_size)
+        stored_outputs = set()
+        if self.outputs_path.exists():
+            stored_outputs = {p.name for p in self.outputs_path.iterdir()}
+        now = time.time()
+        files = {
+            key: entry for key, entry in self._files.items()
+            if now - entry['used'] <= max_age and all(
+                f'{output_hash}.json' in stored_outputs
+                for output_hash in entry['outputs'].values())
+        }
+        files.update(self._new_files)
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        with self.manifest_path.open('w', encoding='utf8') as f:
+            json.dump({
+                'version': MANIFEST_VERSION,
+                'files': files,
+            }, f)
@@ -1,175 +1,634 @@
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 import merge
 import json
 import sys
 from itertools import chain
+from concurrent.futures import ProcessPoolExecutor
+import heapq
+import marshal
+import traceback
 from pathlib import Path
 import math
+import mmap
 import uuid
+import os
+from types import CodeType
 from better_json_tools import load_jsonc
+from template_cache import TemplateCache
+from template_memo import TemplateMemo, is_impure
+from build_manifest import BuildManifest, hash_bytes, hash_json, store_output
+import profiling
 
 DATA_PATH = Path('data')
 BP_PATH = Path('BP')
 RP_PATH = Path('RP')
 
+DEFAULT_SCOPE = {'true': True, 'false': False, 'math': math, 'uuid': uuid}
 
-def walk_json(data, json_path=None):
+# Using the pool for a small number of files is slower than processing them
+# in the main process.
+MIN_PARALLEL_TASKS = 32
+
+
+def _needs_visit(
+        clean: Dict[int, Tuple[Any, int]], value: Any,
+        trigger_phrase: str) -> bool:
+    '''
+    Checks if the value is a JSON object or a list that needs to be visited
+    by replace_templates because it may contain references to the templates.
+
+    The objects that have been already visited and the objects that don't
+    contain any other objects, lists or references (these are marked as clean
+    right away) don't need to be visited. The lists are compared by their
+    length because they can be extended in place by the merge with the
+    ListMergePolicy.APPEND policy.
     '''
-    Walks JSON file (data) yields json paths.
+    if not isinstance(value, (dict, list)):
+        return False
+    entry = clean.get(id(value))
+    if entry is not None and len(value) == entry[1]:
+        return False
+    if isinstance(value, dict):
+        for k, v in value.items():
+            if isinstance(v, (dict, list)) or (
+                    isinstance(k, str) and k.startswith(trigger_phrase)):
+                return True
+    else:
+        for v in value:
+            if isinstance(v, (dict, list)):
+                return True
+    clean[id(value)] = (value, len(value))
+    return False
+
+def _key_order(key: Any) -> Tuple[str, Any]:
     '''
-    if json_path is None:
-        json_path = []
-    if isinstance(data, dict):
-        for k in data.keys():
-            curr_path = json_path + [k]
-            if isinstance(data[k], (dict, list)):
-                yield from walk_json(data[k], json_path=curr_path)
-            yield tuple(curr_path)
-    elif isinstance(data, list):
-        for i in range(len(data)):
-            curr_path = json_path + [i]
-            if isinstance(data[i], (dict, list)):
-                yield from walk_json(data[i], json_path=curr_path)
-            yield tuple(curr_path)
+    Sorting key for the keys of the JSON objects. The keys of the same type
+    are sorted naturally, the keys of different types (possible in the
+    evaluated templates) are grouped by type instead of raising an error.
+    '''
+    return type(key).__name__, key
+
+class _Frame:
+    '''
+    A JSON object or a list that is being visited by replace_templates. The
+    frame holds the reference to its parent, so the object can be replaced
+    in place when a template is applied to it.
+    '''
+    __slots__ = ('node', 'scope', 'parent', 'key', 'pending', 'queued')
+
+    def __init__(
+            self, node: Any, scope: Dict[str, Any], parent: Any, key: Any,
+            trigger_phrase: str, clean: Dict[int, Tuple[Any, int]]):
+        self.node = node
+        self.scope = scope
+        self.parent = parent
+        self.key = key
+        if isinstance(node, dict):
+            # Heap of the keys that still need to be visited in sorted
+            # order. Only the references to the templates and the objects
+            # that may contain them are included.
+            self.pending = [
+                _key_order(k) for k, v in node.items()
+                if (
+                    isinstance(k, str) and k.startswith(trigger_phrase)
+                ) or _needs_visit(clean, v, trigger_phrase)
+            ]
+            heapq.heapify(self.pending)
+            self.queued = {k for _, k in self.pending}
+        else:
+            self.pending = 0  # The index of the next item of the list
+            self.queued = None
 
-def access_json(data, path):
-    if len(path) == 0:
-        return data
-    return access_json(data[path[0]], path[1:])
+    def push(self, key: Any):
+        if key not in self.queued:
+            self.queued.add(key)
+            heapq.heappush(self.pending, _key_order(key))
+
+    def pop(self) -> Any:
+        _, key = heapq.heappop(self.pending)
+        self.queued.discard(key)
+        return key
 
 def replace_templates(
-        data: Any, scope: Dict[str, Any], templates: Dict[str, str],
-        trigger_phrase: str) -> Tuple[Dict, bool]:
-    # Gather points of iterests (things that will be replaced)
-    points_of_interset = []
-    for poi in walk_json(data):
-        k = poi[-1]
-        if isinstance(k, str) and k.startswith(trigger_phrase):
-            points_of_interset.append(poi)
-    if len(points_of_interset) == 0:  # No points of interests, return
+        data: Any, scope: Dict[str, Any], templates: Dict[str, CodeType],
+        trigger_phrase: str,
+        used_templates: Optional[Set[str]]=None,
+        memo: Optional[TemplateMemo]=None) -> Tuple[Dict, bool]:
+    '''
+    Replaces the references to the templates in the data (the keys that start
+    with the trigger phrase) with the evaluated templates. Returns the
+    modified data and the information whether anything has been replaced.
+    The names of the evaluated templates are added to the used_templates set
+    if it's provided. If the memo is provided, the results of the templates
+    evaluated with the same scope are reused.
+
+    The references are expanded in a single depth-first pass in the order of
+    their sorted JSON paths. The variables passed to the template by a
+    reference are also visible in the templates expanded in the rest of
+    the object that contains the reference.
+    '''
+    if not isinstance(data, (dict, list)):
         return data, False
-    for poi in sorted(points_of_interset):
-        # Access template
-        try:
-            k = poi[-1]
-            template_name = k.split(":", 1)[1]
-            template = templates[template_name]
-        except KeyError as e:
-            raise RuntimeError(f"Unable to read template {k}") from e
-
-        # Apply template
-        if len(poi) == 1:  # Templating root
-            try:
-                curr_scope = scope | data[poi[0]]
-            except KeyError:
-                continue  # Replaced by the recursive template execution, skip
-            # delete POI
-            del data[poi[0]]
-            # Merge with template
-            data = merge.deep_merge_objects(
-                a=eval(template, curr_scope),
-                b=data, 
-                list_merge_policy=merge.ListMergePolicy.APPEND)
-            # Run recursive templating
-            data, _ = replace_templates(
-                data, curr_scope, templates, trigger_phrase)
-        else:  # Templating offspring
-            parent = access_json(data, poi[:-2])
-            try:
-                curr_scope = scope |  access_json(parent, poi[-2:])
-            except KeyError:
-                continue  # Replaced by the recursive template execution, skip
-            # delete POI
-            del parent[poi[-2]][poi[-1]]
-            # Merge with template
-            parent[poi[-2]] = merge.deep_merge_objects(
-                a=eval(template, curr_scope),
-                b=parent[poi[-2]],
-                list_merge_policy=merge.ListMergePolicy.APPEND)
-            # Run recursive templating
-            parent[poi[-2]], _ = replace_templates(
-                parent[poi[-2]], curr_scope, templates, trigger_phrase)
-    return data, True
+    modified = False
+    # The objects that have been fully visited and don't contain any
+    # references (id -> (object, length)). The values keep the objects alive,
+    # so their ids can't be reused.
+    clean: Dict[int, Tuple[Any, int]] = {}
+    stack = [_Frame(data, scope, None, None, trigger_phrase, clean)]
+    while len(stack) > 0:
+        frame = stack[-1]
+        node = frame.node
+        child = None
+        if isinstance(node, dict):
+            while len(frame.pending) > 0:
+                k = frame.pop()
+                if k not in node:
+                    continue
+                value = node[k]
+                if not (isinstance(k, str) and k.startswith(trigger_phrase)):
+                    if _needs_visit(clean, value, trigger_phrase):
+                        child = value
+                        break
+                    continue
+                # Access template
+                try:
+                    template_name = k.split(":", 1)[1]
+                    template = templates[template_name]
+                except (KeyError, IndexError) as e:
+                    raise RuntimeError(f"Unable to read template {k}") from e
+                if not isinstance(value, dict):
+                    raise RuntimeError(
+                        f"The scope of the template {k} must be an object")
+                if used_templates is not None:
+                    used_templates.add(template_name)
+                # Apply template
+                # The scope must be a plain dict, the evaluation of the
+                # templates is much slower with the subclasses of dict.
+                frame.scope = frame.scope | value
+                del node[k]
+                if memo is not None:
+                    template_data = memo.evaluate(
+                        template_name, template, frame.scope)
+                else:
+                    template_data = eval(template, frame.scope)
+                node = merge.deep_merge_objects(
+                    a=template_data,
+                    b=node,
+                    list_merge_policy=merge.ListMergePolicy.APPEND)
+                if node is not frame.node:
+                    frame.node = node
+                    if frame.parent is None:
+                        data = node
+                    else:
+                        frame.parent[frame.key] = node
+                    # The keys from the template need to be visited (again)
+                    for template_key in template_data.keys():
+                        frame.push(template_key)
+                modified = True
+        else:
+            while frame.pending < len(node):
+                value = node[frame.pending]
+                frame.pending += 1
+                if _needs_visit(clean, value, trigger_phrase):
+                    child = value
+                    break
+        if child is None:
+            clean[id(node)] = (node, len(node))
+            stack.pop()
+            continue
+        stack.append(_Frame(
+            child, frame.scope, node,
+            k if isinstance(node, dict) else frame.pending - 1,
+            trigger_phrase, clean))
+    return data, modified
 
-def main(
-        bp_patterns: List[str], rp_patterns: List[str],
-        in_place_template_suffix: str, templates_path: str, 
-        trigger_phrase: str, sort_keys: bool, compact: bool, scope: Dict):
+def may_contain_trigger(fp: Path, trigger_phrase: str) -> bool:
     '''
-    Main function of the project. Adds filters to behavior- and resource-pack
-    files. Read README for mor information.
+    Checks if the raw content of the file contains the trigger phrase. The
+    file is not parsed, so it's much faster than loading it. If this function
+    returns False, the file doesn't contain any reference to the templates.
+    The files with escaped characters (the '\\u' sequences) always pass the
+    check because they might hide the trigger phrase.
     '''
-    fp: Path
-    # Resolve glob patterns for inplace templates
-    in_place_paths = set()
-    in_place_paths.update(RP_PATH.rglob(f"*{in_place_template_suffix}"))
-    in_place_paths.update(BP_PATH.rglob(f"*{in_place_template_suffix}"))
-    # Replace values files using templates in place
-    for fp in in_place_paths:
-        if not fp.exists() or not fp.is_file():
-            continue
-        output = fp.with_name(fp.name.replace(
-                in_place_template_suffix, '.json'))
-        if output != fp and output.exists():
-            # This allows a special case where the input and output file are
-            # the same (.json -> .json)
-            print(
-                f"Skipping '{fp.as_posix()}' as the output "
-                f"'{output.as_posix()}' already exists")
-            continue
+    with fp.open('rb') as f:
         try:
-            data_text = fp.read_text(encoding='utf8')
-        except:
-            print(f"Unable to load file {fp.as_posix()}")
-            continue
-        data = eval(data_text, scope)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                return (
+                    m.find(trigger_phrase.encode('utf8')) != -1 or
+                    m.find(b'\\u') != -1)
+        except ValueError:  # Empty files can't be mapped
+            return False
+
+def dump_json(data: Any, fp: Path, sort_keys: bool, compact: bool) -> str:
+    '''
+    Writes the data to the JSON file using the formatting settings of the
+    filter. Returns the written text.
+    '''
+    if compact:
+        text = json.dumps(
+            data, indent='\t', separators=(',', ':'), sort_keys=sort_keys)
+    else:
+        text = json.dumps(data, indent='\t', sort_keys=sort_keys)
+    with fp.open('w') as f:
+        f.write(text)
+    return text
+
+# The result of processing a file by the Worker: the messages to print and
+# the record for the build manifest (the names of the used templates and
+# the hashes of the outputs) or None if the file wasn't processed or its
+# result can't be restored from the cache.
+TaskResult = Tuple[List[str], Optional[Tuple[List[str], Dict[str, str]]]]
+
+class Worker:
+    '''
+    Processes the files. Every process of the pool has its own worker with
+    a copy of the scope and the templates, so they're sent to the process only
+    once. If the outputs_path is provided, the outputs are also stored in
+    the cache of the incremental builds. If the memo_size is greater than 0,
+    the results of the pure templates are memoized.
+    '''
+    def __init__(
+            self, scope: Dict[str, Any], templates: Dict[str, CodeType],
+            trigger_phrase: str, sort_keys: bool, compact: bool,
+            outputs_path: Optional[Path], memo_size: int,
+            impure_templates: Set[str]):
+        self.scope = scope
+        self.templates = templates
+        self.trigger_phrase = trigger_phrase
+        self.sort_keys = sort_keys
+        self.compact = compact
+        self.outputs_path = outputs_path
+        self.memo: Optional[TemplateMemo] = None
+        if memo_size > 0:
+            self.memo = TemplateMemo(memo_size, impure_templates, scope)
+
+    def _dump_output(self, data: Any, fp: Path) -> Dict[str, str]:
+        with profiling.phase('write'):
+            text = dump_json(data, fp, self.sort_keys, self.compact)
+        if self.outputs_path is None:
+            return {}
+        return {fp.as_posix(): store_output(self.outputs_path, text)}
+
+    def eval_in_place_template(
+            self, fp: Path, output: Path, code: bytes) -> TaskResult:
+        '''
+        Evaluates an in-place template (marshalled code object) and saves the
+        result in the output file.
+        '''
+        with profiling.phase('evaluate'):
+            data = eval(marshal.loads(code), self.scope)
         fp.unlink()
-        with output.open('w') as f:
-            if compact:
-                json.dump(
-                    data, f, indent='\t',
-                    separators=(',', ':'), sort_keys=sort_keys)
-            else:
-                json.dump(data, f, indent='\t', sort_keys=sort_keys)
-
-    # Resolve glob patterns for BP  and RP
-    bp_paths = set()
-    for i in bp_patterns:
-        bp_paths.update(BP_PATH.glob(i))
-    rp_paths = set()
-    for i in rp_patterns:
-        rp_paths.update(RP_PATH.glob(i))
+        return [], ([], self._dump_output(data, output))
 
-    # Load the template files
-    templates: Dict[str, str] = {}
-    tp = DATA_PATH / templates_path
-    for template_path in tp.glob("**/*.py"):
-        key = template_path.relative_to(tp).with_suffix("").as_posix()
-        with template_path.open('r') as f:
-            templates[key] = f.read()
+    def eval_multi_output_template(self, fp: Path, code: bytes) -> TaskResult:
+        '''
+        Evaluates a multi-output template (marshalled code object). The
+        result maps the paths of the output files (relative to the directory
+        of the template) to their content. The outputs that already exist are
+        skipped. The result of the template that skipped some of the outputs
+        isn't recorded in the build manifest, because it depends on the
+        files that exist in the packs.
+        '''
+        with profiling.phase('evaluate'):
+            data = eval(marshal.loads(code), self.scope)
+        if not isinstance(data, dict):
+            raise RuntimeError(
+                "The multi-output template must evaluate to an object that "
+                "maps the paths of the output files to their content")
+        # The outputs can't leave the pack of the template (BP or RP). All
+        # of the paths are checked before writing anything.
+        pack_path = Path(fp.parts[0]).resolve()
+        output_paths: List[Path] = []
+        for output_name in data.keys():
+            if not isinstance(output_name, str) or Path(
+                    output_name).is_absolute():
+                raise RuntimeError(
+                    f"Invalid output path {output_name!r} of the "
+                    "multi-output template (expected a relative path)")
+            output = fp.parent / output_name
+            resolved_output = output.resolve()
+            if (
+                    resolved_output == pack_path or
+                    not resolved_output.is_relative_to(pack_path)):
+                raise RuntimeError(
+                    f"Invalid output path {output_name!r} of the "
+                    "multi-output template (the path must be inside of the "
+                    f"{fp.parts[0]} folder)")
+            output_paths.append(output)
+        fp.unlink()
+        messages: List[str] = []
+        outputs: Dict[str, str] = {}
+        created_dirs: Set[Path] = set()
+        for output, output_data in zip(output_paths, data.values()):
+            if output.exists():
+                messages.append(
+                    f"Skipping the output '{output.as_posix()}' of "
+                    f"'{fp.as_posix()}' as it already exists")
+                continue
+            if output.parent not in created_dirs:
+                output.parent.mkdir(parents=True, exist_ok=True)
+                created_dirs.add(output.parent)
+            outputs.update(self._dump_output(output_data, output))
+        if len(messages) > 0:
+            return messages, None
+        return messages, ([], outputs)
 
-    # Replace values in file using templates
-    for fp in chain(bp_paths, rp_paths):
+    def apply_templates(self, fp: Path) -> TaskResult:
+        '''
+        Replaces the references to the templates in the JSON file.
+        '''
         if not fp.exists() or not fp.is_file():
-            continue
+            return [], None
         try:
-            data = load_jsonc(fp).data
+            with profiling.phase('parse'):
+                data = load_jsonc(fp).data
         except:
-            print(f"Unable to load file {fp.as_posix()}")
-            continue
+            return [f"Unable to load file {fp.as_posix()}"], None
 
-        data, modified = replace_templates(
-            data, scope, templates, trigger_phrase)
+        used_templates: Set[str] = set()
+        with profiling.phase('evaluate'):
+            data, modified = replace_templates(
+                data, self.scope, self.templates, self.trigger_phrase,
+                used_templates, self.memo)
         if not modified:
-            continue  # Data not modified. Don't edit the file.
+            # Data not modified. Don't edit the file.
+            return [], (sorted(used_templates), {})
+        return [], (sorted(used_templates), self._dump_output(data, fp))
 
-        with fp.open('w') as f:
-            if compact:
-                json.dump(
-                    data, f, indent='\t',
-                    separators=(',', ':'), sort_keys=sort_keys)
-            else:
-                json.dump(data, f, indent='\t', sort_keys=sort_keys)
+# The worker of the current process of the pool
+_worker: Optional[Worker] = None
+
+def _init_pool_worker(
+        scope_data: Dict[str, Any], templates: bytes, trigger_phrase: str,
+        sort_keys: bool, compact: bool, outputs_path: Optional[Path],
+        memo_size: int, impure_templates: Set[str]):
+    '''
+    Initializes the worker of a process of the pool. The scope is sent
+    without the default values (modules can't be pickled) and the templates
+    are sent as marshalled code objects.
+    '''
+    global _worker
+    _worker = Worker(
+        DEFAULT_SCOPE | scope_data, marshal.loads(templates),
+        trigger_phrase, sort_keys, compact, outputs_path, memo_size,
+        impure_templates)
+
+# The numbers of the memo hits, misses and skipped evaluations
+MemoStats = Tuple[int, int, int]
+
+def _memo_stats() -> MemoStats:
+    if _worker is None or _worker.memo is None:
+        return 0, 0, 0
+    memo = _worker.memo
+    return memo.hits, memo.misses, memo.skipped
+
+def _run_task(
+        task: Tuple[str, Tuple[Any, ...]]
+) -> Tuple[TaskResult, str, MemoStats]:
+    '''
+    Runs a method of the worker of the current process. Returns the result
+    of the method, the error message (empty string if there was no error) and
+    the memo statistics of the task. Catching the errors lets the main process
+    report them in the same order as the files are processed.
+    '''
+    method, args = task
+    before = _memo_stats()
+    try:
+        result: TaskResult = getattr(_worker, method)(*args)
+        error = ""
+    except Exception:
+        # The first argument of the tasks is always the processed file
+        result = ([], None)
+        error = (
+            f"Failed to process file {args[0].as_posix()}:\n"
+            f"{traceback.format_exc()}")
+    after = _memo_stats()
+    return result, error, (
+        after[0] - before[0], after[1] - before[1], after[2] - before[2])
+
+def run_tasks(
+        tasks: List[Tuple[str, Tuple[Any, ...]]],
+        pool: Optional[ProcessPoolExecutor], workers: int,
+        memo_stats: List[int]
+) -> List[Optional[Tuple[List[str], Dict[str, str]]]]:
+    '''
+    Runs the tasks in the pool or in the current process if the pool is not
+    provided or the number of tasks is too small to benefit from it. The
+    messages and errors are reported in the order of the tasks. The first
+    error stops the filter. Returns the build manifest records of the tasks.
+    The memo statistics of the tasks (from all of the processes) are added
+    to the memo_stats list.
+    '''
+    if pool is None or len(tasks) < MIN_PARALLEL_TASKS:
+        results: Iterable[Tuple[TaskResult, str, MemoStats]] = map(
+            _run_task, tasks)
+    else:
+        results = pool.map(
+            _run_task, tasks, chunksize=max(1, len(tasks) // (workers * 4)))
+    records = []
+    for (messages, record), error, task_memo_stats in results:
+        for message in messages:
+            print(message)
+        if error != "":
+            print(error, file=sys.stderr)
+            sys.exit(1)
+        for i, value in enumerate(task_memo_stats):
+            memo_stats[i] += value
+        records.append(record)
+    return records
+
+def main(
+        bp_patterns: List[str], rp_patterns: List[str],
+        in_place_template_suffix: str, multi_template_suffix: str,
+        templates_path: str, trigger_phrase: str, sort_keys: bool, compact: bool,
+        scope: Dict[str, Any], template_cache: TemplateCache, workers: int,
+        incremental_cache_path: Optional[Path], memo_size: int):
+    '''
+    Main function of the project. Adds filters to behavior- and resource-pack
+    files. Read README for mor information.
+
+    The scope is the user defined scope, the default scope is added to it
+    by this function. If the incremental_cache_path is provided, the files
+    that didn't change since the last run are restored from the cache instead
+    of being evaluated. If the memo_size is greater than 0, the results of
+    the templates that are used multiple times with the same scope are
+    reused (up to memo_size results per process).
+    '''
+    global _worker
+    fp: Path
+    # Load the template files
+    templates: Dict[str, CodeType] = {}
+    template_hashes: Dict[str, str] = {}
+    impure_templates: Set[str] = set()
+    tp = DATA_PATH / templates_path
+    with profiling.phase('load_templates'):
+        for template_path in tp.glob("**/*.py"):
+            key = template_path.relative_to(tp).with_suffix("").as_posix()
+            with template_path.open('r') as f:
+                template_text = f.read()
+            templates[key] = template_cache.compile(
+                template_text, template_path.as_posix())
+            if is_impure(template_text, templates[key]):
+                impure_templates.add(key)
+            template_hashes[key] = hash_bytes(template_text.encode('utf8'))
+    profiling.count('templates', len(templates))
+    manifest: Optional[BuildManifest] = None
+    outputs_path: Optional[Path] = None
+    if incremental_cache_path is not None:
+        manifest = BuildManifest(
+            incremental_cache_path,
+            settings={
+                'in_place_template_suffix': in_place_template_suffix,
+                'multi_template_suffix': multi_template_suffix,
+                'trigger_phrase': trigger_phrase,
+                'sort_keys': sort_keys,
+                'compact': compact,
+            },
+            scope_hash=hash_json(scope),
+            template_hashes=template_hashes)
+        outputs_path = manifest.outputs_path
+    _worker = Worker(
+        DEFAULT_SCOPE | scope, templates, trigger_phrase, sort_keys, compact,
+        outputs_path, memo_size, impure_templates)
+    # The memo hits, misses and skipped evaluations
+    memo_stats = [0, 0, 0]
+    pool: Optional[ProcessPoolExecutor] = None
+    if workers > 1:
+        pool = ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_pool_worker,
+            initargs=(
+                scope, marshal.dumps(templates), trigger_phrase, sort_keys,
+                compact, outputs_path, memo_size, impure_templates))
+    try:
+        # Resolve glob patterns for inplace templates
+        in_place_paths = set()
+        with profiling.phase('scan'):
+            in_place_paths.update(
+                RP_PATH.rglob(f"*{in_place_template_suffix}"))
+            in_place_paths.update(
+                BP_PATH.rglob(f"*{in_place_template_suffix}"))
+        # Replace values files using templates in place
+        tasks: List[Tuple[str, Tuple[Any, ...]]] = []
+        task_hashes: List[str] = []
+        for fp in sorted(in_place_paths):
+            if not fp.exists() or not fp.is_file():
+                continue
+            output = fp.with_name(fp.name.replace(
+                    in_place_template_suffix, '.json'))
+            if output != fp and output.exists():
+                # This allows a special case where the input and output file
+                # are the same (.json -> .json)
+                print(
+                    f"Skipping '{fp.as_posix()}' as the output "
+                    f"'{output.as_posix()}' already exists")
+                continue
+            try:
+                data_text = fp.read_text(encoding='utf8')
+            except:
+                print(f"Unable to load file {fp.as_posix()}")
+                continue
+            input_hash = ""
+            if manifest is not None:
+                input_hash = hash_bytes(data_text.encode('utf8'))
+                if manifest.restore('in_place', fp, input_hash):
+                    template_cache.keep(data_text, fp.as_posix())
+                    continue
+            code = template_cache.compile(data_text, fp.as_posix())
+            tasks.append((
+                'eval_in_place_template', (fp, output, marshal.dumps(code))))
+            task_hashes.append(input_hash)
+        # Resolve glob patterns for multi-output templates
+        multi_paths = set()
+        with profiling.phase('scan'):
+            multi_paths.update(RP_PATH.rglob(f"*{multi_template_suffix}"))
+            multi_paths.update(BP_PATH.rglob(f"*{multi_template_suffix}"))
+        # Evaluate multi-output templates
+        for fp in sorted(multi_paths - in_place_paths):
+            if not fp.exists() or not fp.is_file():
+                continue
+            try:
+                data_text = fp.read_text(encoding='utf8')
+            except:
+                print(f"Unable to load file {fp.as_posix()}")
+                continue
+            input_hash = ""
+            if manifest is not None:
+                input_hash = hash_bytes(data_text.encode('utf8'))
+                if manifest.restore('in_place', fp, input_hash):
+                    template_cache.keep(data_text, fp.as_posix())
+                    continue
+            code = template_cache.compile(data_text, fp.as_posix())
+            tasks.append((
+                'eval_multi_output_template', (fp, marshal.dumps(code))))
+            task_hashes.append(input_hash)
+        profiling.count('template_files', len(tasks))
+        with profiling.phase('process'):
+            records = run_tasks(tasks, pool, workers, memo_stats)
+        if manifest is not None:
+            for (_, (fp, *_)), input_hash, record in zip(
+                    tasks, task_hashes, records):
+                if record is not None:
+                    manifest.record('in_place', fp, input_hash, *record)
+
+        # Resolve glob patterns for BP  and RP
+        bp_paths = set()
+        rp_paths = set()
+        with profiling.phase('scan'):
+            for i in bp_patterns:
+                bp_paths.update(BP_PATH.glob(i))
+            for i in rp_patterns:
+                rp_paths.update(RP_PATH.glob(i))
+
+        # Replace values in file using templates
+        tasks = []
+        task_hashes = []
+        skipped = 0
+        for fp in chain(sorted(bp_paths), sorted(rp_paths)):
+            if not fp.is_file():
+                continue
+            if not may_contain_trigger(fp, trigger_phrase):
+                skipped += 1
+                continue
+            input_hash = ""
+            if manifest is not None:
+                input_hash = hash_bytes(fp.read_bytes())
+                if manifest.restore('templates', fp, input_hash):
+                    continue
+            tasks.append(('apply_templates', (fp,)))
+            task_hashes.append(input_hash)
+        profiling.count('files', len(tasks))
+        profiling.count('skipped_files', skipped)
+        with profiling.phase('process'):
+            records = run_tasks(tasks, pool, workers, memo_stats)
+        if manifest is not None:
+            for (_, (fp,)), input_hash, record in zip(
+                    tasks, task_hashes, records):
+                if record is not None:
+                    manifest.record('templates', fp, input_hash, *record)
+        if len(tasks) + skipped > 0:
+            print(
+                f"Parsed {len(tasks)} file(s), skipped {skipped} file(s) "
+                "without the trigger phrase")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    template_cache.save()
+    if memo_size > 0:
+        hits, misses, skipped = memo_stats
+        profiling.count('memo_hits', hits)
+        profiling.count('memo_misses', misses)
+        profiling.count('memo_skipped', skipped)
+        lookups = hits + misses
+        hit_rate = hits / lookups * 100 if lookups > 0 else 0.0
+        print(
+            f"Memoized templates: {hits} hit(s), {misses} miss(es) "
+            f"({hit_rate:.1f}% hit rate), {skipped} evaluation(s) not "
+            "memoized")
+    if manifest is not None:
+        manifest.save()
+        print(
+            f"Restored {manifest.restored} file(s) from the incremental "
+            "build cache")
 
 
 if __name__ == '__main__':
@@ -190,6 +649,10 @@ if __name__ == '__main__':
         in_place_template_suffix = config['in_place_template_suffix']
     else:
         in_place_template_suffix = '.pytemplate.json'
+    if 'multi_template_suffix' in config:
+        multi_template_suffix = config['multi_template_suffix']
+    else:
+        multi_template_suffix = '.pytemplates.json'
 
 
     # File path to the templates folder
@@ -208,20 +671,54 @@ if __name__ == '__main__':
         compact = config['compact']
     else:
         compact = False
+    # Path to the folder with the persistent caches (relative to the project
+    # folder). The data folder isn't exported, so the caches are kept outside
+    # of it.
+    if 'cache_path' in config:
+        cache_path = Path(config['cache_path'])
+    else:
+        cache_path = Path('.regolith/cache/pytemplate')
+    if not cache_path.is_absolute():
+        cache_path = Path(os.environ.get('ROOT_DIR', '.')) / cache_path
+    if 'compile_cache' in config:
+        compile_cache = config['compile_cache']
+    else:
+        compile_cache = False
+    if 'incremental' in config:
+        incremental = config['incremental']
+    else:
+        incremental = False
+    # Maximal number of memoized results of the templates (0 - disabled)
+    if 'memoize' in config:
+        memo_size = config['memoize']
+    else:
+        memo_size = 0
+    # Number of processes used for processing the files (0 - CPU count)
+    if 'workers' in config:
+        workers = config['workers']
+    else:
+        workers = 1
+    if workers == 0:
+        workers = os.cpu_count() or 1
 
     # Add scope
-    scope = {'true': True, 'false': False, 'math': math, 'uuid': uuid}
     if 'scope_path' not in config:
         config['scope_path'] = 'pytemplate/scope.json'
-    scope = scope | load_jsonc(DATA_PATH / config['scope_path']).data
+    scope = load_jsonc(DATA_PATH / config['scope_path']).data
 
-    main(
+    profiling.run('pytemplate', lambda: main(
         bp_patterns=bp_patterns,
         rp_patterns=rp_patterns,
         in_place_template_suffix=in_place_template_suffix,
+        multi_template_suffix=multi_template_suffix,
         templates_path=templates_path,
         trigger_phrase=trigger_phrase,
         sort_keys=sort_keys,
         compact=compact,
         scope=scope,
-    )
+        template_cache=TemplateCache(
+            cache_path / 'templates' if compile_cache else None),
+        workers=workers,
+        incremental_cache_path=cache_path / 'build' if incremental else None,
+        memo_size=memo_size,
+    ), config)
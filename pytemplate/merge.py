@@ -1,4 +1,4 @@
-from typing import Dict, List
+from typing import Dict, List, Tuple, TypeVar, Any
 from enum import Enum, auto
 
 class ListMergePolicy(Enum):
@@ -7,72 +7,112 @@ class ListMergePolicy(Enum):
     B_LENGHT = auto()
     APPEND = auto()
 
-def deep_merge_objects(a, b, list_merge_policy=ListMergePolicy.GREATER_LENGHT):
+T = TypeVar('T')
+
+# A pair of values to merge and the place where the result should be
+# stored (the container and the key or index).
+_MergeTask = Tuple[Any, Any, Any, Any]
+
+def _is_mergeable(a: Any, b: Any) -> bool:
+    '''
+    Checks if A and B can be merged (they're both dicts or both lists of the
+    same type). Otherwise the value from B overwrites the value from A.
+    '''
+    return type(a) == type(b) and isinstance(a, (dict, list))
+
+def _deep_merge(a: Any, b: Any, list_merge_policy: ListMergePolicy) -> Any:
+    '''
+    Merges two mergeable values (see _is_mergeable) without using recursion.
+    The nested values are merged in the same order as they would be merged
+    by the recursive depth-first implementation (the tasks are added to the
+    stack in reversed order).
+    '''
+    root: List[Any] = [None]
+    stack: List[_MergeTask] = [(a, b, root, 0)]
+    while len(stack) > 0:
+        a, b, target, key = stack.pop()
+        if isinstance(a, dict):
+            # The keys of A are first (in their original order) followed by
+            # the keys that are only in B. This is also the fast path for the
+            # disjoint keys and empty dicts.
+            result = dict(a)
+            result.update(b)
+            target[key] = result
+            if len(a) == 0 or len(b) == 0:
+                continue
+            for k, a_value in reversed(a.items()):
+                if k in b:
+                    b_value = b[k]
+                    if (
+                            type(a_value) == type(b_value) and
+                            isinstance(a_value, (dict, list))):
+                        stack.append((a_value, b_value, result, k))
+            continue
+        if list_merge_policy is ListMergePolicy.APPEND:
+            a.extend(b)
+            target[key] = a
+            continue
+        # GREATER_LENGHT is the default
+        list_len = max(len(a), len(b))
+        if list_merge_policy is ListMergePolicy.SMALLER_LENGHT:
+            list_len = min(len(a), len(b))
+        elif list_merge_policy is ListMergePolicy.B_LENGHT:
+            list_len = len(b)
+        # The items of B overwrite the items of A, the items of A are used
+        # only if B is shorter.
+        result = b[:list_len]
+        if list_len > len(b):
+            result.extend(a[len(b):list_len])
+        target[key] = result
+        for i in reversed(range(min(len(a), len(b), list_len))):
+            a_value = a[i]
+            b_value = b[i]
+            if (
+                    type(a_value) == type(b_value) and
+                    isinstance(a_value, (dict, list))):
+                stack.append((a_value, b_value, result, i))
+    return root[0]
+
+def deep_merge_objects(
+    a: Any, b: T,
+    list_merge_policy: ListMergePolicy=ListMergePolicy.GREATER_LENGHT
+) -> T:
     '''
     Merges two JSON objeccts A and B recursively.  In case of conflicts (
     situations where merging is not possible) the value from B overwrites value
     from A. The function doesn't always create a copy of parts of A and B.
     Sometimes uses references to objects that already exist to A or B which
     means that editing returned structure may edit some valeus in A or B.
+
+    The merge doesn't use recursion, so it's safe to use it on very deeply
+    nested objects. The order of the keys is preserved (keys from A are
+    followed by the keys that exist only in B).
     '''
-    # in A and in B
-    if type(a) != type(b):  # different types unable to merge
+    if not _is_mergeable(a, b):
         return b
-    # Both types are the same
-    if isinstance(a, dict):  # Both types are dicts
-        return deep_merge_dicts(a, b, list_merge_policy)
-    elif isinstance(a, list):  # Both types are lists
-        return deep_merge_lists(a, b, list_merge_policy)
-    # Both types are smoething unknown
-    return b
+    return _deep_merge(a, b, list_merge_policy)
 
 def deep_merge_dicts(
-        a: Dict, b: Dict, list_merge_policy=ListMergePolicy.GREATER_LENGHT):
+        a: Dict[Any, Any], b: Dict[Any, Any],
+        list_merge_policy: ListMergePolicy=ListMergePolicy.GREATER_LENGHT
+) -> Dict[Any, Any]:
     '''
     Merges two dictionaries A and B recursively. In case of conflicts (
     situations where merging is not possible) the value from B overwrites value
     from A.
     '''
-    result = {}
-    for k in (a.keys() | b.keys()):
-        if k in b:
-            if k not in a: # in B not in A
-                result[k] = b[k]
-                continue
-            result[k] = deep_merge_objects(a[k], b[k], list_merge_policy)
-        elif k in a:  # in A not in B
-            result[k] = a[k]
-    return result
+    return _deep_merge(a, b, list_merge_policy)
 
 def deep_merge_lists(
-        a: List, b: List, list_merge_policy=ListMergePolicy.GREATER_LENGHT):
+    a: List[Any], b: List[Any],
+    list_merge_policy: ListMergePolicy=ListMergePolicy.GREATER_LENGHT
+) -> List[Any]:
     '''
     Merges two lists A and B recursively. In case of conflicts (
     situations where merging is not possible) the value from B overwrites value
     from A.
     '''
-    # GREATER_LENGHT is the default
-    # if list_merge_policy is ListMergePolicy.GREATER_LENGHT:
-    list_len = max(len(a), len(b))
-    if list_merge_policy is ListMergePolicy.SMALLER_LENGHT:
-        list_len = min(len(a), len(b))
-    elif list_merge_policy is ListMergePolicy.B_LENGHT:
-        list_len = len(b)
-    elif list_merge_policy is ListMergePolicy.APPEND:
-        for b_item in b:
-            a.append(b_item)
-        return a
-    result = [None]*list_len
-    for i in range(list_len):
-        if i < len(b):
-            if i >= len(a): # in B not in A
-                result[i] = b[i]
-                continue
-            # in B and in A
-            result[i] = deep_merge_objects(a[i], b[i], list_merge_policy)
-        elif i < len(a):  # in A not in B
-            result[i] = a[i]
-    return result
+    return _deep_merge(a, b, list_merge_policy)
 
 def test():
     '''Prints some test results of the deep_merge_objects() function.'''
@@ -101,4 +141,4 @@ def test():
     print(result)
 
 # if __name__ == '__main__':
-#     test()
\ No newline at end of file
+#     test()
@@ -0,0 +1,131 @@
+from typing import Dict, Iterable, Optional, Set
+from pathlib import Path
+from types import CodeType
+import hashlib
+import marshal
+import os
+import sys
+import time
+
+# The marshal format of the code objects is specific to the interpreter
+# version, so the cache entries are tagged with it (e.g. 'cpython-311').
+CACHE_TAG = sys.implementation.cache_tag or 'python'
+CACHE_SUFFIX = f'.{CACHE_TAG}.marshal'
+
+# The entries that weren't used for this number of seconds are removed
+MAX_ENTRY_AGE = 30 * 24 * 60 * 60
+# The maximal total size of the entries in bytes. The least recently used
+# entries are removed first.
+MAX_CACHE_SIZE = 64 * 2**20
+
+def prune_cache(entries: Iterable[Path], max_age: float, max_size: int):
+    '''
+    Removes the cache entries that weren't used for more than max_age seconds
+    and the least recently used entries that exceed max_size bytes in total.
+    The modification time of an entry is the time of its last use.
+    '''
+    now = time.time()
+    stats = []
+    for entry in entries:
+        try:
+            stats.append((entry.stat(), entry))
+        except OSError:
+            continue
+    stats.sort(key=lambda item: item[0].st_mtime, reverse=True)
+    total_size = 0
+    for stat, entry in stats:
+        total_size += stat.st_size
+        if now - stat.st_mtime > max_age or total_size > max_size:
+            try:
+                entry.unlink()
+            except OSError:
+                pass
+
+class TemplateCache:
+    '''
+    Compiles the templates into code objects. Every template is compiled only
+    once per run. If the cache_path is provided, the code objects are also
+    stored on disk (using the marshal module) and reused in the following
+    runs. The entries are keyed by the hash of the template (its name and
+    content) and the version of the interpreter. Entries that can't be loaded
+    are treated as stale and replaced with a fresh compilation. The entries
+    are removed from the disk when they aren't used for a long time or when
+    the cache grows too big (see prune_cache).
+    '''
+    def __init__(self, cache_path: Optional[Path]=None):
+        self.cache_path = cache_path
+        self.hits = 0
+        self.misses = 0
+        self._code: Dict[str, CodeType] = {}
+        self._written: Set[str] = set()
+        # The entries loaded from the disk (their time of use is updated)
+        self._used: Set[str] = set()
+
+    def compile(self, source: str, filename: str) -> CodeType:
+        '''
+        Returns the compiled code of the template. The result is the same as
+        the one that would be evaluated by eval(source, ...).
+        '''
+        key = self._key(source, filename)
+        if key in self._code:
+            return self._code[key]
+        code = self._load(key)
+        if code is None:
+            self.misses += 1
+            # eval() strips leading spaces and tabs from the source strings
+            # but compile() doesn't.
+            code = compile(source.lstrip(' \t'), filename, 'eval')
+            self._written.add(key)
+        else:
+            self.hits += 1
+            self._used.add(key)
+        self._code[key] = code
+        return code
+
+    def keep(self, source: str, filename: str):
+        '''
+        Marks the entry of the template as used without compiling it. It's
+        used for the templates that don't need to be evaluated in this run
+        (e.g. restored by the incremental builds), so their entries aren't
+        removed from the cache as unused.
+        '''
+        self._used.add(self._key(source, filename))
+
+    def _key(self, source: str, filename: str) -> str:
+        return hashlib.sha256(
+            f'{filename}\0{source}'.encode('utf8')).hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_path / f'{key}{CACHE_SUFFIX}'
+
+    def _load(self, key: str) -> Optional[CodeType]:
+        if self.cache_path is None:
+            return None
+        try:
+            code = marshal.loads(self._entry_path(key).read_bytes())
+        except (OSError, ValueError, EOFError, TypeError):
+            return None
+        if not isinstance(code, CodeType):
+            return None
+        return code
+
+    def save(self):
+        '''
+        Writes the newly compiled code objects to the cache, updates the time
+        of use of the used entries and removes the old entries.
+        '''
+        if self.cache_path is None:
+            return
+        self.cache_path.mkdir(parents=True, exist_ok=True)
+        for key in self._written:
+            self._entry_path(key).write_bytes(marshal.dumps(self._code[key]))
+        for key in self._used - self._written:
+            try:
+                os.utime(self._entry_path(key))
+            except OSError:
+                pass  # The entry doesn't exist (the template was restored)
+        self._written.clear()
+        self._used.clear()
+        prune_cache(
+            self.cache_path.glob(f'*{CACHE_SUFFIX}'), MAX_ENTRY_AGE,
+            MAX_CACHE_SIZE)
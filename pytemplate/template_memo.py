@@ -0,0 +1,201 @@
+from typing import Any, Dict, Hashable, Iterable, Optional, Set, Tuple
+from collections import OrderedDict
+from copy import deepcopy
+from types import CodeType
+import json
+import time
+
+# The names that make the templates impure (their results can't be reused)
+IMPURE_NAMES = {'uuid', 'random'}
+
+# A comment that can be added to the template to exclude it from memoization
+IMPURE_MARKER = '# pytemplate: impure'
+
+# The number of lookups of a template after which the memo decides if
+# memoizing it is worth it
+MIN_LOOKUPS = 8
+
+def _used_names(code: CodeType) -> Iterable[str]:
+    '''
+    Yields the names used by the code object and the code objects nested in
+    it (e.g. the comprehensions).
+    '''
+    yield from code.co_names
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            yield from _used_names(const)
+
+# The types of the values that don't need to be copied
+IMMUTABLE_TYPES = (str, int, float, bool, type(None))
+
+def copy_json(data: Any, memo: Optional[Dict[int, Any]]=None) -> Any:
+    '''
+    A faster version of deepcopy for JSON-like data. Like deepcopy, it keeps
+    the objects that are referenced multiple times shared in the copy. The
+    values of other types are copied with deepcopy.
+    '''
+    if isinstance(data, IMMUTABLE_TYPES):
+        return data
+    if memo is None:
+        memo = {}
+    result: Any
+    if id(data) in memo:
+        return memo[id(data)]
+    if type(data) is dict:
+        result = memo[id(data)] = {}
+        for k, v in data.items():
+            result[k] = v if isinstance(v, IMMUTABLE_TYPES) else copy_json(
+                v, memo)
+    elif type(data) is list:
+        result = memo[id(data)] = []
+        for v in data:
+            result.append(
+                v if isinstance(v, IMMUTABLE_TYPES) else copy_json(v, memo))
+    else:
+        result = deepcopy(data, memo)
+    return result
+
+def is_impure(source: str, code: CodeType) -> bool:
+    '''
+    Checks if the template is impure (can return different results for the
+    same scope). The template is impure if it uses one of the IMPURE_NAMES or
+    if its source contains the IMPURE_MARKER comment.
+    '''
+    return IMPURE_MARKER in source or not IMPURE_NAMES.isdisjoint(
+        _used_names(code))
+
+class _TemplateStats:
+    '''
+    The statistics of the memoization of a single template used for deciding
+    if memoizing it is faster than evaluating it.
+    '''
+    __slots__ = ('lookups', 'hits', 'evaluations', 'eval_time', 'overhead')
+
+    def __init__(self):
+        self.lookups = 0
+        self.hits = 0
+        self.evaluations = 0
+        # The total time of the evaluations of the template
+        self.eval_time = 0.0
+        # The total time spent on creating the keys and copying the results
+        self.overhead = 0.0
+
+    def is_worth_it(self) -> bool:
+        '''
+        Checks if the time saved by the hits (estimated using the average
+        time of the evaluation) is greater than the overhead of the memo.
+        '''
+        if self.lookups < MIN_LOOKUPS or self.evaluations == 0:
+            return True
+        saved = self.hits * self.eval_time / self.evaluations
+        return saved > self.overhead
+
+class TemplateMemo:
+    '''
+    Remembers the results of the evaluation of the templates. The results are
+    keyed by the name of the template and the variables of its scope that
+    are different from the base scope (the scope that is the same for the
+    whole run). The number of remembered results is limited by the max_size,
+    the least recently used results are removed first. The results are copied
+    when they're stored and returned, so modifying them doesn't affect the
+    memo.
+
+    Creating the keys and copying the results isn't free. It's slower than
+    evaluating the template again if the template is cheap or if it's rarely
+    used with the same variables. The memo measures both costs for every
+    template and stops memoizing the templates for which it doesn't pay off
+    (after MIN_LOOKUPS lookups).
+    '''
+    def __init__(
+            self, max_size: int, impure_templates: Set[str],
+            base_scope: Dict[str, Any]):
+        self.max_size = max_size
+        self.base_scope = base_scope
+        self.impure_templates = impure_templates
+        self.hits = 0
+        self.misses = 0
+        # The evaluations of the templates that aren't memoized
+        self.skipped = 0
+        self._results: OrderedDict[Hashable, Any] = OrderedDict()
+        self._stats: Dict[str, _TemplateStats] = {}
+        # The templates that aren't worth memoizing
+        self._disabled: Set[str] = set()
+
+    def evaluate(
+            self, template_name: str, code: CodeType,
+            scope: Dict[str, Any]) -> Any:
+        '''
+        Returns the result of the template evaluated with the scope. The
+        result is reused if the template was already evaluated with the same
+        variables.
+        '''
+        if template_name in self._disabled:
+            self.skipped += 1
+            return eval(code, scope)
+        start = time.perf_counter()
+        key = self.key(template_name, scope)
+        if key is None:
+            self.skipped += 1
+            return eval(code, scope)
+        stats = self._stats.get(template_name)
+        if stats is None:
+            stats = self._stats[template_name] = _TemplateStats()
+        stats.lookups += 1
+        found, result = self.get(key)
+        if found:
+            stats.hits += 1
+            stats.overhead += time.perf_counter() - start
+        else:
+            eval_start = time.perf_counter()
+            result = eval(code, scope)
+            eval_end = time.perf_counter()
+            self.put(key, result)
+            stats.evaluations += 1
+            stats.eval_time += eval_end - eval_start
+            stats.overhead += (
+                eval_start - start + time.perf_counter() - eval_end)
+        if not stats.is_worth_it():
+            self._disabled.add(template_name)
+        return result
+
+    def key(
+            self, template_name: str, scope: Dict[str, Any]
+    ) -> Optional[Tuple[str, str]]:
+        '''
+        Returns the key of the template evaluated with the scope or None if
+        the result of the template can't be memoized.
+        '''
+        if template_name in self.impure_templates:
+            return None
+        base_scope = self.base_scope
+        # The eval function adds the __builtins__ to the scope, and the
+        # nested templates inherit it
+        variables = {
+            k: v for k, v in scope.items()
+            if (k not in base_scope or base_scope[k] is not v) and
+            k != '__builtins__'}
+        # The variables are compared by their JSON representation. The keys
+        # aren't sorted because their order can affect the result.
+        try:
+            return template_name, json.dumps(variables)
+        except (TypeError, ValueError):
+            return None
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        '''
+        Returns a tuple with a boolean that says if the result was found and
+        the copy of the result.
+        '''
+        if key not in self._results:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        self._results.move_to_end(key)
+        return True, copy_json(self._results[key])
+
+    def put(self, key: Hashable, result: Any):
+        '''Stores the copy of the result.'''
+        self._results[key] = copy_json(result)
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_size:
+            self._results.popitem(last=False)
@@ -0,0 +1,77 @@
+'''
+This script is used for testing the error handling of the parallel processing
+of pytemplate. It runs the filter in a separate folder with files that can't
+be loaded or evaluated and checks if the messages and the first error are
+reported in the order of the files, no matter which process handled them.
+
+Settings:
+- workers - the number of processes used by the filter.
+'''
+from pathlib import Path
+import json
+import shutil
+import subprocess
+import sys
+
+TEST_PATH = Path("check_errors")
+FILES = 40
+# The files that can't be loaded (reported with a message)
+INVALID_FILES = [3, 12]
+# The files that reference a missing template (reported as errors, the first
+# one stops the filter)
+FAILING_FILES = [25, 35]
+
+def file_path(i: int) -> str:
+    return f"BP/generated/file_{i:02}.json"
+
+def main():
+    config = json.loads(sys.argv[1])
+    if TEST_PATH.exists():
+        shutil.rmtree(TEST_PATH)
+    (TEST_PATH / "BP/generated").mkdir(parents=True)
+    (TEST_PATH / "data/pytemplate").mkdir(parents=True)
+    (TEST_PATH / "data/pytemplate/scope.json").write_text("{}")
+    for i in range(FILES):
+        if i in INVALID_FILES:
+            text = '{"TEMPLATE:missing": '
+        elif i in FAILING_FILES:
+            text = json.dumps({"TEMPLATE:missing": {}})
+        else:
+            # Contains the trigger phrase, so the file is parsed
+            text = json.dumps({"value": "TEMPLATE"})
+        (TEST_PATH / file_path(i)).write_text(text)
+    # The test project is in the test folder of the filter
+    filter_path = Path(__file__).resolve().parents[2] / 'main.py'
+    print(f"Running {filter_path} in: {TEST_PATH}")
+    result = subprocess.run(
+        [
+            sys.executable, str(filter_path),
+            json.dumps({
+                "bp_patterns": ["**/*.json"],
+                "workers": config['workers']})
+        ],
+        cwd=TEST_PATH, capture_output=True, text=True)
+    if result.returncode != 1:
+        raise Exception(
+            f"Expected the exit code 1, got {result.returncode}:\n"
+            f"{result.stdout}\n{result.stderr}")
+    messages = [
+        line for line in result.stdout.splitlines()
+        if line.startswith("Unable to load file")]
+    expected_messages = [
+        f"Unable to load file {file_path(i)}" for i in INVALID_FILES]
+    if messages != expected_messages:
+        raise Exception(
+            f"Unexpected messages:\n{messages}\n"
+            f"Expected:\n{expected_messages}")
+    first_error = f"Failed to process file {file_path(FAILING_FILES[0])}"
+    if first_error not in result.stderr:
+        raise Exception(f"Expected the error: {first_error}\n{result.stderr}")
+    for i in FAILING_FILES[1:]:
+        if file_path(i) in result.stderr:
+            raise Exception(
+                f"Only the first error should be reported:\n{result.stderr}")
+    shutil.rmtree(TEST_PATH)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+'''
+This script is used for testing the parallel processing of pytemplate. It
+checks the files generated by the generate_files.py script and removes them,
+so they don't have to be listed in the expected output of the filter_tester.
+'''
+from pathlib import Path
+import json
+import shutil
+
+GENERATED_PATH = Path("BP/generated")
+GENERATED_FILES = 40
+NAMESPACE = "nusiq"
+
+def expected_file(i: int) -> dict:
+    names = [f"state_{i}_a", f"state_{i}_b"]
+    return {
+        "component_groups": {
+            f"{NAMESPACE}:{name}": {"minecraft:variant": {"value": j}}
+            for j, name in enumerate(names)
+        },
+        "events": {
+            f"{NAMESPACE}:{name}": {
+                "add": {"component_groups": [f"{NAMESPACE}:{name}"]},
+                "remove": {
+                    "component_groups": [
+                        f"{NAMESPACE}:{n}" for n in names if n != name]
+                }
+            } for name in names
+        },
+        "id": i
+    }
+
+def main():
+    print(f"Checking the evaluated files in: {GENERATED_PATH}")
+    for i in range(GENERATED_FILES):
+        for path, expected in (
+                (GENERATED_PATH / f"file_{i:02}.json", expected_file(i)),
+                (
+                    GENERATED_PATH / f"inplace_{i:02}.json",
+                    {"id": i, "square": i * i, "namespace": NAMESPACE})):
+            with path.open("r") as f:
+                data = json.load(f)
+            if data != expected:
+                raise Exception(
+                    f"Unexpected content of {path}:\n"
+                    f"Expected: {expected}\n"
+                    f"Actual: {data}")
+    remaining = sorted(
+        p.name for p in GENERATED_PATH.iterdir()
+        if p.suffix == ".pytemplate")
+    if len(remaining) > 0:
+        raise Exception(f"The in-place templates weren't removed: {remaining}")
+    shutil.rmtree(GENERATED_PATH)
+
+if __name__ == "__main__":
+    main()
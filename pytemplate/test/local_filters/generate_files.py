@@ -0,0 +1,29 @@
+'''
+This script is used for testing the parallel processing of pytemplate. It
+generates enough JSON files with the references to the templates and
+in-place templates to process them in the pool of the filter.
+'''
+from pathlib import Path
+import json
+
+GENERATED_PATH = Path("BP/generated")
+GENERATED_FILES = 40
+
+def main():
+    print(f"Generating {GENERATED_FILES} files in: {GENERATED_PATH}")
+    GENERATED_PATH.mkdir(parents=True)
+    for i in range(GENERATED_FILES):
+        data = {
+            "id": i,
+            "TEMPLATE:named_states": {
+                "names": [f"state_{i}_a", f"state_{i}_b"],
+                "int_component": "variant"
+            }
+        }
+        with (GENERATED_PATH / f"file_{i:02}.json").open("w") as f:
+            json.dump(data, f)
+        (GENERATED_PATH / f"inplace_{i:02}.pytemplate").write_text(
+            f'{{"id": {i}, "square": {i} * {i}, "namespace": namespace}}')
+
+if __name__ == "__main__":
+    main()
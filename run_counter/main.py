@@ -1,12 +1,35 @@
 '''
 This is just a stupid little tool that counts the number of runs in Regolith.
 The output file is in .gitignore, so it won't be committed to the repo.
+
+Optionally, it records the telemetry of the builds (duration, number and
+size of the files, digest of the content) to a JSONL file and can report the
+regressions of the pack size and build duration across the runs.
 '''
 from pathlib import Path
+from datetime import datetime, timezone
+from fnmatch import fnmatchcase
+from typing import Any, Optional
+import hashlib
+import json
+import os
+import statistics
+import sys
+import time
+import profiling
 
-COUNTER_PATH = Path('data/run_counter/counter.txt')
+DATA_PATH = Path('data/run_counter')
+COUNTER_PATH = DATA_PATH / 'counter.txt'
+HISTORY_PATH = DATA_PATH / 'history.jsonl'
+MARKER_PATH = DATA_PATH / 'marker.json'
 
-def main():
+# The folders measured by the "record" mode
+MEASURED_PATHS = [Path('BP'), Path('RP'), Path('data')]
+# The paths skipped by the "record" mode by default. The caches of the other
+# filters change in every run, even if the packs don't.
+DEFAULT_EXCLUDE = ['data/*/.cache']
+
+def increment_counter() -> int:
     if not COUNTER_PATH.exists():
         COUNTER_PATH.parent.mkdir(parents=True, exist_ok=True)
         COUNTER_PATH.write_text('0')
@@ -14,6 +37,209 @@ def main():
     counter = int(COUNTER_PATH.read_text())
     counter += 1
     COUNTER_PATH.write_text(str(counter))
+    return counter
+
+def write_marker():
+    '''
+    Saves the current time. The next "record" run measures the duration of
+    the build from this point.
+    '''
+    MARKER_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with MARKER_PATH.open('w', encoding='utf8') as f:
+        json.dump({"time": time.time()}, f)
+
+def take_marker() -> Optional[float]:
+    '''
+    Returns the time saved by the "marker" mode and removes the marker, so it
+    isn't reused by the following runs. Returns None if there is no marker.
+    '''
+    try:
+        with MARKER_PATH.open('r', encoding='utf8') as f:
+            marker_time = float(json.load(f)["time"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    MARKER_PATH.unlink()
+    return marker_time
+
+def is_excluded(path: Path, exclude: list[str]) -> bool:
+    '''
+    Checks if the path matches any of the exclude patterns. The files of this
+    filter are always excluded because they change in every run.
+    '''
+    if path == DATA_PATH:
+        return True
+    path_str = path.as_posix()
+    return any(fnmatchcase(path_str, pattern) for pattern in exclude)
+
+def measure(root: Path, digest: Any, exclude: list[str]) -> dict[str, int]:
+    '''
+    Counts the files in the root folder and their total size. Updates the
+    digest with the paths and the content of the files. The files and
+    folders that match the exclude patterns are skipped.
+    '''
+    files = 0
+    size = 0
+    for dir_path, dir_names, file_names in os.walk(root):
+        # Walk in a stable order
+        dir_names[:] = sorted(
+            d for d in dir_names
+            if not is_excluded(Path(dir_path) / d, exclude))
+        for name in sorted(file_names):
+            path = Path(dir_path) / name
+            if is_excluded(path, exclude):
+                continue
+            files += 1
+            size += path.stat().st_size
+            digest.update(path.as_posix().encode('utf8') + b'\0')
+            with path.open('rb') as f:
+                while chunk := f.read(1 << 20):
+                    digest.update(chunk)
+            digest.update(b'\0')
+    return {"files": files, "size": size}
+
+def record(run: int, exclude: list[str]):
+    '''
+    Appends a record with the telemetry of this run to the history file.
+    '''
+    now = time.time()
+    marker_time = take_marker()
+    digest = hashlib.sha256()
+    with profiling.phase('measure'):
+        packs = {
+            root.as_posix(): measure(root, digest, exclude)
+            for root in MEASURED_PATHS}
+    entry = {
+        "run": run,
+        "timestamp": datetime.fromtimestamp(now, timezone.utc).isoformat(
+            timespec='seconds'),
+        # None if the "marker" mode didn't run before this filter
+        "duration": None if marker_time is None else round(
+            now - marker_time, 3),
+        "files": sum(p["files"] for p in packs.values()),
+        "size": sum(p["size"] for p in packs.values()),
+        "packs": packs,
+        "digest": digest.hexdigest(),
+    }
+    HISTORY_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with HISTORY_PATH.open('a', encoding='utf8') as f:
+        f.write(json.dumps(entry) + '\n')
+    duration = (
+        "unknown" if entry["duration"] is None else f"{entry['duration']}s")
+    print(
+        f"Run {run}: {entry['files']} file(s), {entry['size']} byte(s), "
+        f"duration: {duration}")
+
+def load_history() -> list[dict[str, Any]]:
+    if not HISTORY_PATH.exists():
+        return []
+    history = []
+    with HISTORY_PATH.open('r', encoding='utf8') as f:
+        for line in f:
+            line = line.strip()
+            if line == '':
+                continue
+            try:
+                history.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue  # Partially written line
+    return history
+
+def compare(
+        name: str, value: Optional[float], previous: list[Optional[float]],
+        threshold: float) -> Optional[str]:
+    '''
+    Compares the value with the median of the previous values. Returns the
+    description of the regression or None if the value didn't grow more than
+    the threshold (a fraction of the median).
+    '''
+    known = [v for v in previous if v is not None]
+    if value is None or len(known) == 0:
+        return None
+    baseline = statistics.median(known)
+    if baseline <= 0 or value <= baseline * (1 + threshold):
+        return None
+    return (
+        f"{name}: {value:g} (baseline {baseline:g}, "
+        f"+{(value / baseline - 1) * 100:.1f}%)")
+
+def report(
+        window: int, size_threshold: float,
+        duration_threshold: float) -> bool:
+    '''
+    Compares the last record of the history with the median of the previous
+    "window" records. Prints the regressions and returns True if there are
+    any.
+    '''
+    history = load_history()
+    if len(history) < 2:
+        print("Not enough records in the history to report the regressions")
+        return False
+    last = history[-1]
+    previous = history[-window - 1:-1]
+    regressions = [
+        compare(
+            "Build duration", last.get("duration"),
+            [r.get("duration") for r in previous], duration_threshold),
+        compare(
+            "Total size", last.get("size"),
+            [r.get("size") for r in previous], size_threshold),
+    ]
+    for pack in sorted(last.get("packs", {})):
+        regressions.append(compare(
+            f"{pack} size", last["packs"][pack].get("size"),
+            [r.get("packs", {}).get(pack, {}).get("size") for r in previous],
+            size_threshold))
+    found = [r for r in regressions if r is not None]
+    print(
+        f"Compared run {last.get('run')} with {len(previous)} previous "
+        f"run(s), found {len(found)} regression(s)")
+    for r in found:
+        print(f"  {r}")
+    return len(found) > 0
+
+def main():
+    try:
+        config = json.loads(sys.argv[1])
+    except Exception:
+        config = {}
+    if 'mode' in config:
+        mode = config['mode']
+    else:
+        mode = "count"
+    if 'window' in config:
+        window = int(config['window'])
+    else:
+        window = 5
+    if 'size_threshold' in config:
+        size_threshold = float(config['size_threshold'])
+    else:
+        size_threshold = 0.1
+    if 'duration_threshold' in config:
+        duration_threshold = float(config['duration_threshold'])
+    else:
+        duration_threshold = 0.25
+    if 'fail_on_regression' in config:
+        fail_on_regression = bool(config['fail_on_regression'])
+    else:
+        fail_on_regression = False
+    if 'exclude' in config:
+        exclude = list(config['exclude'])
+    else:
+        exclude = DEFAULT_EXCLUDE
+
+    if mode == "count":
+        increment_counter()
+    elif mode == "marker":
+        write_marker()
+    elif mode == "record":
+        record(increment_counter(), exclude)
+    elif mode == "report":
+        regression = report(window, size_threshold, duration_threshold)
+        if regression and fail_on_regression:
+            sys.exit(1)
+    else:
+        print(f"Unknown mode: {mode}", file=sys.stderr)
+        sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    profiling.run('run_counter', main)
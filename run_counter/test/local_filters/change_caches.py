@@ -0,0 +1,17 @@
+'''
+This script is used for testing the "record" mode of run_counter. It
+simulates a filter that updates its cache in every run, even if the packs
+don't change.
+'''
+from pathlib import Path
+import time
+
+CACHE_PATH = Path("data/cached_filter/.cache/entry.txt")
+
+def main():
+    print(f"Updating {CACHE_PATH}")
+    CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    CACHE_PATH.write_text(str(time.time_ns()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+'''
+This script is used for testing run_counter. The data of the filter is
+exported, so the counter and the history are preserved between the test runs.
+Because of that, the script checks how they changed during the run, instead
+of checking their values.
+
+Settings:
+- step - "before" saves the current state, "after" compares the current
+  state with the saved one.
+- counter - the expected increase of the counter (the "after" step).
+- records - the expected number of the new records in the history (the
+  "after" step).
+- same_digest - if true, the new records must have the same digest (the
+  "after" step).
+- known_durations - a list of booleans which says which of the new records
+  must have the duration (the "after" step).
+'''
+from pathlib import Path
+import json
+import sys
+
+COUNTER_PATH = Path("data/run_counter/counter.txt")
+HISTORY_PATH = Path("data/run_counter/history.jsonl")
+STATE_PATH = Path("data/check_run_counter/state.json")
+
+def read_state() -> dict:
+    counter = 0
+    if COUNTER_PATH.exists():
+        counter = int(COUNTER_PATH.read_text())
+    history = []
+    if HISTORY_PATH.exists():
+        with HISTORY_PATH.open('r', encoding='utf8') as f:
+            history = [json.loads(line) for line in f if line.strip() != '']
+    return {"counter": counter, "history": history}
+
+def main():
+    config = json.loads(sys.argv[1])
+    state = read_state()
+    if config['step'] == "before":
+        STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        STATE_PATH.write_text(json.dumps({
+            "counter": state["counter"],
+            "history_length": len(state["history"])}))
+        return
+    previous = json.loads(STATE_PATH.read_text())
+    counter = state["counter"] - previous["counter"]
+    print(f"The counter increased by {counter}")
+    if counter != config['counter']:
+        raise Exception(
+            f"Expected the counter to increase by {config['counter']}")
+    records = state["history"][previous["history_length"]:]
+    print(f"Added {len(records)} record(s) to the history")
+    if len(records) != config['records']:
+        raise Exception(f"Expected {config['records']} new record(s)")
+    for record in records:
+        if record["run"] != previous["counter"] + 1:
+            raise Exception(
+                f"Unexpected number of the run in the record: {record}")
+        previous["counter"] += 1
+    if config.get('same_digest', False):
+        digests = {record["digest"] for record in records}
+        if len(digests) != 1:
+            raise Exception(
+                f"Expected the same digest in all new records: {digests}")
+    if 'known_durations' in config:
+        known_durations = [r["duration"] is not None for r in records]
+        if known_durations != config['known_durations']:
+            raise Exception(
+                f"Expected known durations: {config['known_durations']}, "
+                f"got: {known_durations}")
+
+if __name__ == "__main__":
+    main()
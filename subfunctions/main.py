@@ -1,4 +1,5 @@
 from regolith_subfunctions import main
+import profiling
 
 if __name__ == "__main__":
-    main()
+    profiling.run('subfunctions', main)
@@ -0,0 +1,199 @@
+'''
+Opt-in profiling of the filter. The same module is copied to every Python
+filter of the repository (Regolith installs every filter separately, so they
+can't share it). The copies must be kept identical.
+
+The profiling is enabled by the "profiling" setting of the filter or by the
+REGOLITH_FILTER_PROFILE environment variable (set to "1" or "all" to profile
+all filters, or to a comma-separated list of the filter names). The results
+are written to profile/<filter>/ in the root of the Regolith project (the
+data folder isn't used, because it's discarded after the run unless the
+filter exports it):
+- profile.pstats - the cProfile stats (can be loaded with the pstats module
+  or tools like snakeviz),
+- profile.json - the wall and CPU time, the peak of the memory allocated by
+  Python (tracemalloc), the timings of the phases, the counters and the
+  functions with the highest cumulative time.
+When the profiling is disabled, the phase and count functions do nothing.
+'''
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypeVar
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+ENV_VAR = 'REGOLITH_FILTER_PROFILE'
+# The path to the results of the profiling, relative to the project root
+PROFILE_PATH = Path('profile')
+
+# The folders in which the files are counted before and after the filter
+COUNTED_PATHS = [Path('BP'), Path('RP'), Path('data')]
+
+# The number of the functions listed in the JSON report
+TOP_FUNCTIONS = 30
+
+T = TypeVar('T')
+
+_enabled = False
+_profiler: Optional[cProfile.Profile] = None
+# The name of the phase -> [total time in seconds, number of calls]
+_phases: Dict[str, List[float]] = {}
+_counts: Dict[str, int] = {}
+# The phases and counters can be updated from multiple threads
+_lock = threading.Lock()
+
+def is_enabled(
+        filter_name: str, config: Optional[Dict[str, Any]]=None) -> bool:
+    '''
+    Checks if the profiling of the filter is enabled by the environment
+    variable or by the "profiling" setting. If the config is None, the
+    settings are loaded from the command line arguments.
+    '''
+    env_value = os.environ.get(ENV_VAR, '').strip()
+    if env_value.lower() in ('1', 'true', 'all'):
+        return True
+    if filter_name in (name.strip() for name in env_value.split(',')):
+        return True
+    if config is None:
+        try:
+            config = json.loads(sys.argv[1])
+        except Exception:
+            config = {}
+    return isinstance(config, dict) and bool(config.get('profiling', False))
+
+def _stop_in_child():
+    '''
+    Stops the profiling in the processes created by os.fork (like the
+    workers of the process pools). They inherit the state of the profiler,
+    but their results are never saved, so profiling them would only slow
+    them down.
+    '''
+    global _enabled
+    if not _enabled:
+        return
+    _enabled = False
+    if _profiler is not None:
+        _profiler.disable()
+    tracemalloc.stop()
+
+if hasattr(os, 'register_at_fork'):  # Not available on Windows
+    os.register_at_fork(after_in_child=_stop_in_child)
+
+def output_path(filter_name: str) -> Path:
+    '''
+    Returns the path to the folder with the results of the profiling of the
+    filter.
+    '''
+    return Path(os.environ.get('ROOT_DIR', '.')) / PROFILE_PATH / filter_name
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    '''
+    Measures the time of the code in the "with" block and adds it to the
+    phase. The phases can be nested and entered multiple times. The time of
+    the phases that run in parallel threads is summed.
+    '''
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            timing = _phases.setdefault(name, [0.0, 0])
+            timing[0] += elapsed
+            timing[1] += 1
+
+def count(name: str, n: int=1):
+    '''Adds n to the counter.'''
+    if _enabled:
+        with _lock:
+            _counts[name] = _counts.get(name, 0) + n
+
+def _count_files() -> Dict[str, int]:
+    result = {}
+    for root in COUNTED_PATHS:
+        result[root.as_posix()] = sum(
+            len(file_names) for _, _, file_names in os.walk(root))
+    return result
+
+def _top_functions(stats: pstats.Stats) -> List[Dict[str, Any]]:
+    # The stats attribute isn't documented but it's the only way to access
+    # the data without parsing the printed output.
+    entries = getattr(stats, 'stats')
+    top = sorted(entries.items(), key=lambda item: item[1][3], reverse=True)
+    result = []
+    for (file_name, line, function_name), (_, calls, tt, ct, _) in (
+            top[:TOP_FUNCTIONS]):
+        result.append({
+            "function": f"{file_name}:{line}({function_name})",
+            "calls": calls,
+            "total_time": round(tt, 6),
+            "cumulative_time": round(ct, 6),
+        })
+    return result
+
+def run(
+        filter_name: str, main: Callable[[], T],
+        config: Optional[Dict[str, Any]]=None) -> T:
+    '''
+    Runs the main function of the filter. If the profiling is enabled, the
+    function is profiled and the results are written to the output_path of
+    the filter (also when the main function raises an exception).
+    '''
+    global _enabled, _profiler
+    if not is_enabled(filter_name, config):
+        return main()
+    _enabled = True
+    _phases.clear()
+    _counts.clear()
+    files_before = _count_files()
+    profiler = _profiler = cProfile.Profile()
+    tracemalloc.start()
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    try:
+        return profiler.runcall(main)
+    finally:
+        wall_time = time.perf_counter() - start_wall
+        cpu_time = time.process_time() - start_cpu
+        _, memory_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        _enabled = False
+        _profiler = None
+        profile_path = output_path(filter_name)
+        profile_path.mkdir(parents=True, exist_ok=True)
+        stats = pstats.Stats(profiler)
+        stats.dump_stats(profile_path / 'profile.pstats')
+        report = {
+            "filter": filter_name,
+            "timestamp": datetime.now(timezone.utc).isoformat(
+                timespec='seconds'),
+            "wall_time": round(wall_time, 6),
+            "cpu_time": round(cpu_time, 6),
+            "memory_peak": memory_peak,
+            "phases": {
+                name: {"time": round(t, 6), "calls": int(calls)}
+                for name, (t, calls) in _phases.items()
+            },
+            "counts": _counts.copy(),
+            "files": {
+                "before": files_before,
+                "after": _count_files(),
+            },
+            "top_functions": _top_functions(stats),
+        }
+        with (profile_path / 'profile.json').open('w', encoding='utf8') as f:
+            json.dump(report, f, indent='\t')
+        print(
+            f"Profile of {filter_name}: {wall_time:.3f}s, memory peak: "
+            f"{memory_peak / 2**20:.1f} MiB, saved to "
+            f"{profile_path.as_posix()}")
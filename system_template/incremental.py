@@ -0,0 +1,446 @@
+'''
+The incremental mode of the filter. It evaluates the systems in the same way
+as the "eval" mode of regolith_system_template, but it remembers the
+dependency graph of the build (the inputs of every system, the files it
+generated and its entries of the log). In the following runs, only the
+systems whose inputs changed are evaluated again. The files of the other
+systems are restored from the cache.
+'''
+from pathlib import Path
+from typing import Any, Optional, TypedDict
+import hashlib
+import json
+import os
+import shutil
+import regolith_json_template
+import regolith_subfunctions
+import regolith_system_template
+from regolith_system_template import (
+    MergeStatus, NamespaceSettings, Report, System, SystemItem,
+    SystemTemplateException, get_auto_map, get_scope, is_uniform_types_dict,
+    system_paths_sort_key, walk_system_paths)
+import profiling
+
+SYSTEMS_PATH = Path('data/system_template')
+FUNCTIONS_PATH = Path('BP/functions')
+GRAPH_VERSION = 1
+
+# The settings that don't affect the generated files
+IGNORED_SETTINGS = ('incremental', 'cache_path', 'log_path', 'profiling')
+
+# The target types that are evaluated with subfunctions. Subfunctions can
+# create additional files in the functions folder.
+SUBFUNCTION_TYPES = ('.mcfunction', '.lang')
+
+def hash_file(path: Path) -> Optional[str]:
+    '''Returns the hash of the file or None if the file doesn't exist.'''
+    if not path.is_file():
+        return None
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+def hash_tree(path: Path) -> str:
+    '''
+    Returns the hash of the paths and the content of the files in the
+    directory.
+    '''
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            file = Path(root) / name
+            digest.update(file.relative_to(path).as_posix().encode('utf8'))
+            digest.update(f'\0{hash_file(file)}\0'.encode('utf8'))
+    return digest.hexdigest()
+
+def filter_version() -> str:
+    '''
+    Returns the hash of the source code of the filter and the versions of the
+    libraries used for generating the files.
+    '''
+    version = hashlib.sha256()
+    for module in (
+            regolith_system_template, regolith_subfunctions,
+            regolith_json_template):
+        module_version = getattr(module, '__version__', '')
+        version.update(f'{module.__name__}=={module_version}\0'.encode())
+    for source in sorted(Path(__file__).parent.glob('*.py')):
+        version.update(source.read_bytes())
+    return version.hexdigest()
+
+def global_digest(
+        config: dict[str, Any], scope_path: Path, auto_map_path: Path) -> str:
+    '''
+    Returns the hash of the inputs shared by all of the systems. If it
+    changes, all of the systems are evaluated again.
+    '''
+    digest = hashlib.sha256(filter_version().encode('utf8'))
+    settings = {
+        k: v for k, v in config.items() if k not in IGNORED_SETTINGS}
+    digest.update(json.dumps(settings, sort_keys=True).encode('utf8'))
+    digest.update(f'\0{hash_file(scope_path)}'.encode('utf8'))
+    digest.update(f'\0{hash_file(auto_map_path)}'.encode('utf8'))
+    digest.update(f'\0{hash_tree(SYSTEMS_PATH / "_plugins")}'.encode('utf8'))
+    return digest.hexdigest()
+
+def system_digest(
+        system_path: Path, group_path: Optional[Path],
+        external: list[str]) -> str:
+    '''
+    Returns the hash of the inputs of the system: the files in the system
+    folder (including _map.py, _scope.json and the plugins), the
+    _group_scope.json file of its group and the external files (the possible
+    locations of its shared files).
+    '''
+    digest = hashlib.sha256(hash_tree(system_path).encode('utf8'))
+    if group_path is not None:
+        group_scope = hash_file(group_path / '_group_scope.json')
+        digest.update(
+            f'\0{group_path.as_posix()}\0{group_scope}'.encode('utf8'))
+    for path in external:
+        digest.update(f'\0{path}\0{hash_file(Path(path))}'.encode('utf8'))
+    return digest.hexdigest()
+
+def snapshot(path: Path) -> dict[str, tuple[int, int]]:
+    '''
+    Returns the modification times and the sizes of the files in the
+    directory.
+    '''
+    result: dict[str, tuple[int, int]] = {}
+    for root, _, files in os.walk(path):
+        for name in files:
+            file = Path(root) / name
+            stat = file.stat()
+            result[file.as_posix()] = (stat.st_mtime_ns, stat.st_size)
+    return result
+
+class RecordingReport(Report):
+    '''
+    The report that also remembers the order of its entries, so the entries
+    of every system can be replayed in the following runs.
+    '''
+    def __init__(self):
+        super().__init__()
+        self.entries: list[tuple[str, str, str]] = []
+
+    def append_source(
+            self, target: Path, source: Path, status: MergeStatus):
+        super().append_source(target, source, status)
+        self.entries.append(
+            (target.as_posix(), source.as_posix(), status.value))
+
+class SystemRecord(TypedDict):
+    # The hash of the inputs of the system (see system_digest)
+    inputs: str
+    # The files outside of the system folder that can affect the system
+    external: list[str]
+    # The systems that run Python scripts are evaluated in every run
+    volatile: bool
+    # The files generated or modified by the system
+    outputs: list[str]
+    # The entries of the log (target, source, status)
+    report: list[tuple[str, str, str]]
+
+class OutputRecord(TypedDict):
+    # The hashes of the file before and after running the filter (None if
+    # the file doesn't exist)
+    pre: Optional[str]
+    post: Optional[str]
+
+class OutputStore:
+    '''
+    Stores the content of the generated files. The files are named after the
+    hashes of their content, so the same content is stored only once.
+    '''
+    def __init__(self, path: Path):
+        self.path = path
+
+    def has(self, key: Optional[str]) -> bool:
+        return key is None or (self.path / key).is_file()
+
+    def store(self, file: Path) -> Optional[str]:
+        '''Stores the file and returns its key (None if it doesn't exist).'''
+        key = hash_file(file)
+        if key is None or (self.path / key).is_file():
+            return key
+        self.path.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path / f'{key}.{os.getpid()}.tmp'
+        shutil.copyfile(file, tmp_path)
+        os.replace(tmp_path, self.path / key)
+        return key
+
+    def restore(self, key: Optional[str], file: Path):
+        '''
+        Replaces the file with the stored content. If the key is None, the
+        file is removed.
+        '''
+        if key is None:
+            if file.is_file():
+                file.unlink()
+            return
+        file.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(self.path / key, file)
+
+    def prune(self, used_keys: set[str]):
+        '''Removes the files that aren't used by the build anymore.'''
+        if not self.path.exists():
+            return
+        for stored in self.path.iterdir():
+            if stored.name not in used_keys:
+                stored.unlink()
+
+class IncrementalBuild:
+    '''
+    The dependency graph of the build. It maps the systems to their inputs
+    and outputs, and the outputs to their content before and after running
+    the filter.
+    '''
+    def __init__(self, cache_path: Path, digest: str):
+        self.graph_path = cache_path / 'graph.json'
+        self.store = OutputStore(cache_path / 'outputs')
+        self.digest = digest
+        self.systems: dict[str, SystemRecord] = {}
+        self.outputs: dict[str, OutputRecord] = {}
+        # The hashes of the files before the filter modified them
+        self._pre_hashes: dict[str, Optional[str]] = {}
+        try:
+            graph = json.loads(self.graph_path.read_text(encoding='utf8'))
+        except (OSError, ValueError):
+            return  # Missing or damaged graph (full build)
+        if (
+                not isinstance(graph, dict) or
+                graph.get('version') != GRAPH_VERSION or
+                graph.get('digest') != digest):
+            return  # The global inputs changed (full build)
+        self.systems = graph['systems']
+        self.outputs = graph['outputs']
+
+    def _pre_hash(self, output: str) -> Optional[str]:
+        if output not in self._pre_hashes:
+            self._pre_hashes[output] = hash_file(Path(output))
+        return self._pre_hashes[output]
+
+    def _is_clean(
+            self, name: str, system_path: Path,
+            group_path: Optional[Path]) -> bool:
+        '''
+        Checks if the system can be restored from the cache: its inputs
+        didn't change, the files it modifies are the same as in the previous
+        run before the filter and the cache has all of its outputs.
+        '''
+        record = self.systems.get(name)
+        if record is None or record['volatile']:
+            return False
+        if record['inputs'] != system_digest(
+                system_path, group_path, record['external']):
+            return False
+        for output in record['outputs']:
+            output_record = self.outputs.get(output)
+            if (
+                    output_record is None or
+                    self._pre_hash(output) != output_record['pre'] or
+                    not self.store.has(output_record['post'])):
+                return False
+        return True
+
+    def run(
+            self, sorted_system_paths: list[tuple[Path, Optional[Path]]],
+            create_system: Any, report: RecordingReport) -> int:
+        '''
+        Evaluates the systems that changed and restores the others. The
+        create_system is a function that creates the System object from the
+        path of the system and the path of its group. Returns the number of
+        restored systems.
+        '''
+        paths = {
+            system_path.relative_to(SYSTEMS_PATH).as_posix(): (
+                system_path, group_path)
+            for system_path, group_path in sorted_system_paths}
+        dirty = {
+            name for name, (system_path, group_path) in paths.items()
+            if not self._is_clean(name, system_path, group_path)}
+        # The outputs that must be generated again. It includes the outputs
+        # of the removed systems, they could be shared with the other systems.
+        dirty_outputs: set[str] = set()
+        for name, record in self.systems.items():
+            if name not in paths:
+                dirty_outputs.update(record['outputs'])
+        # The systems that write to the same files must be evaluated together
+        # (in the right order), so the systems that share the outputs with
+        # the dirty systems are also dirty. The targets of the items are
+        # known before evaluating them, so the new outputs are also checked.
+        systems: dict[str, System] = {}
+        items: dict[str, list[SystemItem]] = {}
+        pending = sorted(dirty)
+        while len(pending) > 0:
+            for name in pending:
+                system = create_system(*paths[name])
+                systems[name] = system
+                items[name] = list(system.walk_system_items())
+                for item in items[name]:
+                    # Remember the state of the targets before modifying them
+                    dirty_outputs.add(item.target.as_posix())
+                    self._pre_hash(item.target.as_posix())
+                if name in self.systems:
+                    dirty_outputs.update(self.systems[name]['outputs'])
+            pending = [
+                name for name in paths
+                if name not in dirty and
+                not dirty_outputs.isdisjoint(self.systems[name]['outputs'])]
+            dirty.update(pending)
+
+        records: dict[str, SystemRecord] = {}
+        restored_outputs: set[str] = set()
+        for name, (system_path, _) in paths.items():
+            if name in dirty:
+                print(f"Generating system: {name}")
+                records[name] = self._evaluate(
+                    systems[name], items[name], report)
+                continue
+            record = records[name] = self.systems[name]
+            for output in record['outputs']:
+                if output not in restored_outputs:
+                    self.store.restore(
+                        self.outputs[output]['post'], Path(output))
+                    restored_outputs.add(output)
+            for target, source, status in record['report']:
+                report.append_source(
+                    Path(target), Path(source), MergeStatus(status))
+        self._save(records, dirty, restored_outputs)
+        return len(paths) - len(dirty)
+
+    def _evaluate(
+            self, system: System, items: list[SystemItem],
+            report: RecordingReport) -> SystemRecord:
+        '''
+        Evaluates the items of the system and returns its record.
+        '''
+        first_entry = len(report.entries)
+        outputs = {item.target.as_posix() for item in items}
+        # Subfunctions can create files that aren't the targets of the items
+        track_functions = any(
+            item.subfunctions and item.target_file_type in SUBFUNCTION_TYPES
+            for item in items)
+        functions_before = snapshot(FUNCTIONS_PATH) if track_functions else {}
+        volatile = False
+        external: set[str] = set()
+        for item in items:
+            item.eval(report)
+            volatile = volatile or item.python_script
+            if item.shared:
+                # The shared files are looked up in the system, its group and
+                # the global _shared folder.
+                if system.group_path is not None:
+                    external.add((
+                        system.group_path / '_shared' /
+                        item.relative_source_path).as_posix())
+                external.add((
+                    SYSTEMS_PATH / '_shared' /
+                    item.relative_source_path).as_posix())
+        if track_functions:
+            for path, state in snapshot(FUNCTIONS_PATH).items():
+                if path in outputs or functions_before.get(path) == state:
+                    continue
+                if path in functions_before:
+                    # Modified a file without being its target, it's not
+                    # possible to restore its previous content.
+                    volatile = True
+                outputs.add(path)
+        return SystemRecord(
+            inputs=system_digest(
+                system.system_path, system.group_path, sorted(external)),
+            external=sorted(external),
+            volatile=volatile,
+            outputs=sorted(outputs),
+            report=report.entries[first_entry:])
+
+    def _save(
+            self, records: dict[str, SystemRecord], dirty: set[str],
+            restored_outputs: set[str]):
+        '''
+        Stores the outputs of the evaluated systems and saves the graph.
+        '''
+        outputs: dict[str, OutputRecord] = {
+            output: self.outputs[output] for output in restored_outputs}
+        for name in dirty:
+            for output in records[name]['outputs']:
+                if output in restored_outputs:
+                    # A file created by Subfunctions of an evaluated system
+                    # overwrote an output of a restored system. The graph
+                    # didn't predict it, so the output might be wrong.
+                    self.graph_path.unlink(missing_ok=True)
+                    raise SystemTemplateException([
+                        "The incremental build failed because an evaluated "
+                        "system modified a file generated by a system "
+                        "restored from the cache:",
+                        f"File: {output}",
+                        "The cache has been cleared. Run the filter again."])
+                if output not in outputs:
+                    outputs[output] = OutputRecord(
+                        pre=self._pre_hashes.get(output),
+                        post=self.store.store(Path(output)))
+        self.graph_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.graph_path.with_name(
+            f'{self.graph_path.name}.{os.getpid()}.tmp')
+        with tmp_path.open('w', encoding='utf8') as f:
+            json.dump({
+                "version": GRAPH_VERSION,
+                "digest": self.digest,
+                "systems": records,
+                "outputs": outputs,
+            }, f)
+        os.replace(tmp_path, self.graph_path)
+        self.store.prune({
+            o['post'] for o in outputs.values() if o['post'] is not None})
+
+def main_incremental(
+        config: dict[str, Any], cache_path: Path, log_path: Optional[Path]):
+    '''
+    Runs the "eval" mode of the filter incrementally. The settings are the
+    same as in the regolith_system_template.main_regolith function. The
+    cache_path is the path to the folder with the dependency graph and the
+    stored outputs.
+    '''
+    system_patterns = config.get('systems', ['**'])
+    if 'prioritized_systems' in config:
+        prioritized_systems = [
+            SYSTEMS_PATH / p for p in config['prioritized_systems']]
+    else:
+        prioritized_systems = []
+    namespace_settings: Optional[NamespaceSettings] = None
+    if 'namespace' in config:
+        namespace_settings = NamespaceSettings(config['namespace'])
+    global_replacements: Optional[dict[Any, Any]] = config.get(
+        'replacements', None)
+    if global_replacements is not None:
+        if not is_uniform_types_dict(global_replacements, str, str):
+            raise SystemTemplateException([
+                "The 'replacements' property must be an object with string "
+                "keys and string values or omitted."])
+    scope_path = Path('data') / config.get(
+        'scope_path', 'system_template/scope.json')
+    auto_map_path = SYSTEMS_PATH / 'auto_map.json'
+    allowed_target_prefixes = ['BP/', 'RP/', 'data/']
+
+    scope = get_scope(
+        config.get('scope', {}), scope_path, SYSTEMS_PATH,
+        global_replacements)
+    auto_map = get_auto_map(
+        scope, namespace_settings, auto_map_path, global_replacements)
+    sorted_system_paths = sorted(
+        walk_system_paths(system_patterns, SYSTEMS_PATH),
+        key=lambda sp: system_paths_sort_key(sp, prioritized_systems))
+
+    def create_system(system_path: Path, group_path: Optional[Path]):
+        return System(
+            scope, system_path, group_path, auto_map, namespace_settings,
+            global_replacements, SYSTEMS_PATH, allowed_target_prefixes)
+
+    report = RecordingReport()
+    build = IncrementalBuild(
+        cache_path, global_digest(config, scope_path, auto_map_path))
+    restored = build.run(sorted_system_paths, create_system, report)
+    print(f"Restored {restored} system(s) from the incremental build cache")
+    profiling.count('systems', len(sorted_system_paths))
+    profiling.count('restored_systems', restored)
+    if log_path is not None:
+        report.dump_report(log_path)
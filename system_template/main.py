@@ -1,4 +1,62 @@
-from regolith_system_template import main_regolith
+from pathlib import Path
+from typing import Any, Optional
+import json
+import os
+import sys
+from better_json_tools import JSONCDecoder
+import regolith_system_template
+from regolith_system_template import (
+    SystemTemplateException, main_regolith, print_red, print_yellow)
+import profiling
+
+# The version of regolith_system_template supported by the incremental mode.
+# The incremental mode evaluates the systems using the classes of the library
+# instead of its main function, so it must be checked again when the library
+# is updated.
+INCREMENTAL_LIBRARY_VERSION = '1.4.0'
+
+def get_project_path(path: str) -> Path:
+    '''
+    Returns the path relative to the project folder (the same way as the
+    regolith_system_template resolves the path to the log file).
+    '''
+    result = Path(path)
+    if not result.is_absolute():
+        result = Path(os.environ['ROOT_DIR']) / result
+    return result
+
+def main():
+    try:
+        config = json.loads(sys.argv[1], cls=JSONCDecoder)
+    except Exception:
+        config = None
+    if not isinstance(config, dict) or not config.get('incremental', False):
+        # The "pack", "unpack" and "undo" commands and the full builds
+        main_regolith()
+        return
+    library_version = getattr(regolith_system_template, '__version__', None)
+    if library_version != INCREMENTAL_LIBRARY_VERSION:
+        print_yellow(
+            "The incremental mode requires regolith_system_template "
+            f"{INCREMENTAL_LIBRARY_VERSION} (installed: {library_version}). "
+            "Running a full build.")
+        main_regolith()
+        return
+    # Imported here, because the module uses the classes of the library
+    # which might not exist in the other versions.
+    from incremental import main_incremental
+
+    log_path: Optional[Path] = None
+    if 'log_path' in config:
+        log_path = get_project_path(config['log_path'])
+    cache_path = get_project_path(
+        config.get('cache_path', '.regolith/cache/system_template'))
+    try:
+        main_incremental(config, cache_path, log_path)
+    except SystemTemplateException as e:
+        for err in e.errors:
+            print_red(err)
+        sys.exit(1)
 
 if __name__ == "__main__":
-    main_regolith()
+    profiling.run('system_template', main)
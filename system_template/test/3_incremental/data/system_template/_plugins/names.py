@@ -0,0 +1,2 @@
+def entity_name(name: str):
+    return f'incremental:{name}'
@@ -0,0 +1,7 @@
+[
+    {
+        "source": "entity.behavior.json",
+        "target": "BP/entities/c.behavior.json",
+        "json_template": True
+    }
+]
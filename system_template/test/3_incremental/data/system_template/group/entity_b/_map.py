@@ -0,0 +1,14 @@
+[
+    {
+        "source": "entity.behavior.json",
+        "target": "BP/entities/b.behavior.json",
+        "json_template": True
+    },
+    # Both systems of the group export the shared file only once
+    {
+        "source": "SHARED:shared_family.behavior.json",
+        "target": "BP/entities/shared.behavior.json",
+        "on_conflict": "merge",
+        "export_once": True
+    }
+]
@@ -0,0 +1,23 @@
+'''
+This script is used for testing the incremental builds. It removes the cache
+of System Template from the project folder, so the test always starts with a
+full build.
+
+Settings:
+- path - the path to the cache, relative to the project folder.
+'''
+from pathlib import Path
+import json
+import os
+import shutil
+import sys
+
+def main():
+    config = json.loads(sys.argv[1])
+    path = Path(os.environ['ROOT_DIR']) / config['path']
+    print(f"Removing the cache: {path.as_posix()}")
+    if path.exists():
+        shutil.rmtree(path)
+
+if __name__ == "__main__":
+    main()
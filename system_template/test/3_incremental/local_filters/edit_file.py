@@ -0,0 +1,20 @@
+'''
+This script is used for testing the incremental builds. It changes the inputs
+of System Template between the runs of the filter.
+
+Settings:
+- path - the path to the file.
+- text - the new content of the file.
+'''
+from pathlib import Path
+import json
+import sys
+
+def main():
+    config = json.loads(sys.argv[1])
+    path = Path(config['path'])
+    print(f"Editing {path.as_posix()}")
+    path.write_text(config['text'], encoding='utf8')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+'''
+This script is used for testing the incremental builds. It saves the packs
+and the log of System Template, so the filter can be run multiple times on the
+same input in one profile and the results of the incremental and the full
+builds can be compared.
+
+Settings:
+- action - "save" copies the packs and the log to the snapshot, "restore"
+  replaces the packs with the ones from the snapshot and "compare" checks if
+  the packs and the log are the same as in the snapshot.
+- name - the name of the snapshot.
+- log_path - the path to the log file, relative to the project folder
+  (optional).
+'''
+from pathlib import Path
+import filecmp
+import json
+import os
+import shutil
+import sys
+
+SNAPSHOTS_PATH = Path("snapshots")
+PACKS = ["BP", "RP"]
+
+def list_files(path: Path) -> set[str]:
+    return {
+        p.relative_to(path).as_posix() for p in path.rglob("*")
+        if p.is_file()}
+
+def compare(path: Path, snapshot_path: Path) -> list[str]:
+    '''Returns the list of the files that are different in the folders.'''
+    files = list_files(path)
+    snapshot_files = list_files(snapshot_path)
+    different = sorted(files ^ snapshot_files)
+    for file in sorted(files & snapshot_files):
+        if not filecmp.cmp(path / file, snapshot_path / file, shallow=False):
+            different.append(file)
+    return [(path / file).as_posix() for file in different]
+
+def main():
+    config = json.loads(sys.argv[1])
+    snapshot_path = SNAPSHOTS_PATH / config['name']
+    log_path = None
+    if 'log_path' in config:
+        log_path = Path(os.environ['ROOT_DIR']) / config['log_path']
+    if config['action'] == "save":
+        print(f"Saving the snapshot: {config['name']}")
+        if snapshot_path.exists():
+            shutil.rmtree(snapshot_path)
+        for pack in PACKS:
+            shutil.copytree(pack, snapshot_path / pack)
+        if log_path is not None:
+            shutil.copyfile(log_path, snapshot_path / 'log.json')
+    elif config['action'] == "restore":
+        print(f"Restoring the snapshot: {config['name']}")
+        for pack in PACKS:
+            shutil.rmtree(pack)
+            shutil.copytree(snapshot_path / pack, pack)
+    elif config['action'] == "compare":
+        print(f"Comparing with the snapshot: {config['name']}")
+        different = []
+        for pack in PACKS:
+            different.extend(compare(Path(pack), snapshot_path / pack))
+        if log_path is not None and not filecmp.cmp(
+                log_path, snapshot_path / 'log.json', shallow=False):
+            different.append(log_path.as_posix())
+        if len(different) > 0:
+            raise Exception(
+                "The files are different from the snapshot:\n" +
+                "\n".join(different))
+    else:
+        raise Exception(f"Unknown action: {config['action']}")
+
+if __name__ == "__main__":
+    main()